@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""Offline benchmark for the ``start_charm`` handler of every charm.
+
+Each charm's ``reactive/charm.py`` is imported against in-process stubs of
+``charms.layer``, ``charms.reactive``, ``charmhelpers.core.hookenv`` and
+``charmhelpers.core.unitdata``, and ``start_charm`` is called directly. No
+Juju controller or Kubernetes cluster is needed.
+
+For every charm the benchmark records:
+
+* wall time of the first (cold) run and the fastest of the following (warm)
+  runs; the unit key/value store persists between runs like it does between
+  hooks,
+* peak Python memory allocated during the warm run,
+* time spent in ``subprocess.run`` during the cold and warm runs,
+* the JSON-serialized size of the pod spec and Kubernetes resources handed to
+  ``pod_spec_set``.
+
+Results are checked against ``budgets.yaml`` next to this file and the
+process exits non-zero when any budget is exceeded, so it can gate changes:
+
+    python3 benchmarks/bench_start_charm.py
+    python3 benchmarks/bench_start_charm.py --charm istio-galley --runs 5
+    python3 benchmarks/bench_start_charm.py --json > bench_output.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from types import ModuleType, SimpleNamespace
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+CHARMS = ROOT / "charms"
+LAYERS = ROOT / "layers"
+BUDGETS = Path(__file__).resolve().parent / "budgets.yaml"
+
+# Kubernetes rejects objects larger than this, and Juju stores the pod spec
+# and Kubernetes resources as objects of their own.
+K8S_OBJECT_LIMIT = 1024 * 1024
+
+MODEL_NAME = "kubeflow"
+
+# Ports advertised by the http relations the charms consume.
+RELATION_PORTS = {
+    "istio-citadel": 8060,
+    "istio-galley": 9901,
+    "istio-ingressgateway": 80,
+    "istio-pilot": 15010,
+    "istio-policy": 9091,
+    "istio-telemetry": 9091,
+    "istio-tracing": 9411,
+    "prometheus": 9090,
+}
+
+
+class Harness:
+    """Fake hook environment for a single charm."""
+
+    def __init__(self, charm_dir):
+        self.charm_dir = Path(charm_dir).resolve()
+        self.name = charm_dir.name
+        self.kv = {}
+        self.leader = {}
+        self.flags = set()
+        self.config = self._load_config()
+        self.pod_spec = None
+        self.k8s_resources = None
+        self.subprocess_time = 0.0
+
+    def _layer_dirs(self):
+        # Local layers, each after the layers it includes, the same order
+        # ``charm build`` applies them in.
+        dirs = []
+
+        def visit(directory):
+            includes = yaml.safe_load((directory / "layer.yaml").read_text())
+            for name in includes.get("includes", []):
+                layer_dir = LAYERS / name[len("layer:") :]
+                if layer_dir.is_dir() and layer_dir not in dirs:
+                    visit(layer_dir)
+                    dirs.append(layer_dir)
+
+        visit(self.charm_dir)
+        return dirs
+
+    def _load_config(self):
+        config = {}
+        sources = [d / "config.yaml" for d in self._layer_dirs()]
+        sources.append(self.charm_dir / "config.yaml")
+        for source in sources:
+            if not source.exists():
+                continue
+            options = (yaml.safe_load(source.read_text()) or {}).get("options") or {}
+            for key, option in options.items():
+                config[key] = option.get("default")
+        return config
+
+    def pod_spec_set(self, spec, k8s_resources=None):
+        self.pod_spec = spec
+        self.k8s_resources = k8s_resources
+
+    def endpoint_from_name(self, name):
+        port = RELATION_PORTS.get(name, 80)
+        services = [
+            {"service_name": name, "hosts": [{"hostname": name, "port": port}]}
+        ]
+        return SimpleNamespace(services=lambda: services)
+
+    def run(self, *args, **kwargs):
+        kwargs.setdefault("stdout", subprocess.DEVNULL)
+        kwargs.setdefault("stderr", subprocess.DEVNULL)
+        start = time.perf_counter()
+        try:
+            return _real_run(*args, **kwargs)
+        finally:
+            self.subprocess_time += time.perf_counter() - start
+
+    def install(self):
+        """Register stub modules in ``sys.modules`` for this charm."""
+
+        def passthrough(*_args, **_kwargs):
+            return lambda func: func
+
+        hookenv = ModuleType("charmhelpers.core.hookenv")
+        hookenv.config = lambda key=None: (
+            self.config if key is None else self.config.get(key)
+        )
+        hookenv.service_name = lambda: self.name
+        hookenv.application_name = lambda: self.name
+        hookenv.local_unit = lambda: f"{self.name}/0"
+        hookenv.log = lambda *args, **kwargs: None
+        hookenv.is_leader = lambda: True
+        hookenv.leader_get = lambda key=None: (
+            dict(self.leader) if key is None else self.leader.get(key)
+        )
+        hookenv.leader_set = lambda settings=None, **kwargs: self.leader.update(
+            settings or {}, **kwargs
+        )
+        hookenv.status_set = lambda *args, **kwargs: None
+
+        kv = SimpleNamespace(
+            get=lambda key, default=None: self.kv.get(key, default),
+            set=lambda key, value: self.kv.__setitem__(key, value),
+            unset=lambda key: self.kv.pop(key, None),
+            flush=lambda: None,
+        )
+        unitdata = ModuleType("charmhelpers.core.unitdata")
+        unitdata.kv = lambda: kv
+
+        core = ModuleType("charmhelpers.core")
+        core.hookenv = hookenv
+        core.unitdata = unitdata
+        charmhelpers = ModuleType("charmhelpers")
+        charmhelpers.core = core
+
+        reactive = ModuleType("charms.reactive")
+        reactive.hookenv = hookenv
+        reactive.hook = passthrough
+        reactive.when = passthrough
+        reactive.when_all = passthrough
+        reactive.when_any = passthrough
+        reactive.when_not = passthrough
+        reactive.when_none = passthrough
+        reactive.set_flag = self.flags.add
+        reactive.clear_flag = self.flags.discard
+        reactive.is_flag_set = lambda flag: flag in self.flags
+        reactive.endpoint_from_name = self.endpoint_from_name
+
+        status = SimpleNamespace(
+            maintenance=lambda msg: None,
+            active=lambda msg: None,
+            blocked=lambda msg: None,
+            waiting=lambda msg: None,
+        )
+        docker_resource = SimpleNamespace(
+            get_info=lambda resource: SimpleNamespace(
+                registry_path=f"registry.example.com/{self.name}/{resource}",
+                username="username",
+                password="password",
+            )
+        )
+        layer = ModuleType("charms.layer")
+        layer.__path__ = []
+        layer.status = status
+        layer.docker_resource = docker_resource
+        layer.caas_base = SimpleNamespace(pod_spec_set=self.pod_spec_set)
+
+        charms = ModuleType("charms")
+        charms.__path__ = []
+        charms.layer = layer
+        charms.reactive = reactive
+
+        sys.modules.update(
+            {
+                "charmhelpers": charmhelpers,
+                "charmhelpers.core": core,
+                "charmhelpers.core.hookenv": hookenv,
+                "charmhelpers.core.unitdata": unitdata,
+                "charms": charms,
+                "charms.layer": layer,
+                "charms.reactive": reactive,
+            }
+        )
+
+        subprocess.run = self.run
+
+        # Layer libraries are imported for real, the same way the charm
+        # would see them after ``charm build``.
+        for layer_dir in self._layer_dirs():
+            for lib in sorted((layer_dir / "lib" / "charms" / "layer").glob("*.py")):
+                module = _load_module(f"charms.layer.{lib.stem}", lib)
+                setattr(layer, lib.stem, module)
+
+    def load_charm(self):
+        name = f"bench_{self.name.replace('-', '_')}"
+        return _load_module(name, self.charm_dir / "reactive" / "charm.py")
+
+
+_real_run = subprocess.run
+
+
+def _load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@contextmanager
+def _charm_environment(harness):
+    cwd = os.getcwd()
+    saved = dict(sys.modules)
+    os.environ["JUJU_MODEL_NAME"] = MODEL_NAME
+    os.chdir(harness.charm_dir)
+    try:
+        harness.install()
+        yield harness.load_charm()
+    finally:
+        subprocess.run = _real_run
+        os.chdir(cwd)
+        for name in set(sys.modules) - set(saved):
+            del sys.modules[name]
+        sys.modules.update(saved)
+
+
+def _spec_size(value):
+    if value is None:
+        return 0
+    return len(json.dumps(value, sort_keys=True).encode("utf-8"))
+
+
+def bench_charm(charm_dir, runs):
+    harness = Harness(charm_dir)
+    with _charm_environment(harness) as charm:
+        start = time.perf_counter()
+        charm.start_charm()
+        cold = time.perf_counter() - start
+        cold_subprocess = harness.subprocess_time
+
+        warm = None
+        peak = 0
+        warm_subprocess = 0.0
+        for _ in range(max(runs - 1, 1)):
+            harness.flags.discard("charm.started")
+            harness.subprocess_time = 0.0
+            tracemalloc.start()
+            start = time.perf_counter()
+            charm.start_charm()
+            elapsed = time.perf_counter() - start
+            _, run_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            if warm is None or elapsed < warm:
+                warm = elapsed
+                warm_subprocess = harness.subprocess_time
+            peak = max(peak, run_peak)
+
+    spec_bytes = _spec_size(harness.pod_spec)
+    resource_bytes = _spec_size(harness.k8s_resources)
+    return {
+        "charm": harness.name,
+        "cold_seconds": cold,
+        "warm_seconds": warm,
+        "cold_subprocess_seconds": cold_subprocess,
+        "warm_subprocess_seconds": warm_subprocess,
+        "peak_memory_bytes": peak,
+        "pod_spec_bytes": spec_bytes,
+        "k8s_resources_bytes": resource_bytes,
+    }
+
+
+def check_budgets(result, budgets):
+    """Return a list of budget violations for a single benchmark result."""
+    failures = []
+    limits = {}
+    limits.update(budgets.get("default", {}))
+    limits.update(budgets.get("charms", {}).get(result["charm"], {}))
+    for key, limit in limits.items():
+        if key in result and result[key] > limit:
+            failures.append(
+                f"{result['charm']}: {key} {result[key]:.6g} > {limit:.6g}"
+            )
+    for key in ("pod_spec_bytes", "k8s_resources_bytes"):
+        if result[key] > K8S_OBJECT_LIMIT:
+            failures.append(
+                f"{result['charm']}: {key} exceeds the Kubernetes object size limit"
+            )
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--charm", action="append", help="only benchmark the named charm(s)"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="number of start_charm calls per charm"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument(
+        "--budgets", type=Path, default=BUDGETS, help="budget file to check against"
+    )
+    args = parser.parse_args(argv)
+
+    charm_dirs = sorted(p for p in CHARMS.iterdir() if (p / "reactive").is_dir())
+    if args.charm:
+        charm_dirs = [p for p in charm_dirs if p.name in args.charm]
+
+    budgets = {}
+    if args.budgets.exists():
+        budgets = yaml.safe_load(args.budgets.read_text()) or {}
+    results = [bench_charm(charm_dir, args.runs) for charm_dir in charm_dirs]
+    failures = [f for result in results for f in check_budgets(result, budgets)]
+
+    if args.json:
+        print(json.dumps({"results": results, "failures": failures}, indent=2))
+    else:
+        header = (
+            f"{'charm':<24}{'cold s':>9}{'warm s':>9}{'subproc s':>11}"
+            f"{'peak KiB':>10}{'spec KiB':>10}{'k8s KiB':>9}"
+        )
+        print(header)
+        print("-" * len(header))
+        for r in results:
+            print(
+                f"{r['charm']:<24}"
+                f"{r['cold_seconds']:>9.3f}"
+                f"{r['warm_seconds']:>9.3f}"
+                f"{r['cold_subprocess_seconds']:>11.3f}"
+                f"{r['peak_memory_bytes'] / 1024:>10.0f}"
+                f"{r['pod_spec_bytes'] / 1024:>10.1f}"
+                f"{r['k8s_resources_bytes'] / 1024:>9.1f}"
+            )
+        for failure in failures:
+            print(f"BUDGET EXCEEDED: {failure}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 from glob import glob
 from pathlib import Path
 
+from charmhelpers.core import hookenv
 from charms import layer
 from charms.reactive import clear_flag, hook, set_flag, when, when_any, when_not
 
@@ -27,7 +28,17 @@ def start_charm():
 
     image_info = layer.docker_resource.get_info("oci-image")
 
-    layer.caas_base.pod_spec_set(
+    config = hookenv.config()
+    try:
+        resources = layer.istio_resources.container_resources(
+            config, "grafana", "standard"
+        )
+        log_level = layer.istio_logging.level(config)
+    except ValueError as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
+
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
             "containers": [
@@ -38,12 +49,15 @@ def start_charm():
                         "username": image_info.username,
                         "password": image_info.password,
                     },
+                    "kubernetes": {"resources": resources},
                     "config": {
                         "GRAFANA_PORT": "3000",
                         "GF_AUTH_BASIC_ENABLED": "false",
                         "GF_AUTH_ANONYMOUS_ENABLED": "true",
                         "GF_AUTH_ANONYMOUS_ORG_ROLE": "Admin",
                         "GF_PATHS_DATA": "/tmp/grafana",
+                        "GF_LOG_LEVEL": log_level,
+                        **layer.istio_logging.environment(config),
                     },
                     "ports": [{"name": "http", "containerPort": 3000}],
                     "files": [
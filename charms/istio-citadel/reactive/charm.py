@@ -1,5 +1,6 @@
 import os
 
+from charmhelpers.core import hookenv
 from charms import layer
 from charms.reactive import clear_flag, hook, set_flag, when, when_any, when_not
 
@@ -14,6 +15,11 @@ def charm_ready():
     layer.status.active("")
 
 
+@when("istio-citadel.available")
+def configure_http(http):
+    http.configure(port=8060, hostname=hookenv.application_name())
+
+
 @when_any("layer.docker-resource.oci-image.changed")
 def update_image():
     clear_flag("charm.started")
@@ -28,7 +34,17 @@ def start_charm():
 
     model = os.environ["JUJU_MODEL_NAME"]
 
-    layer.caas_base.pod_spec_set(
+    config = hookenv.config()
+    try:
+        resources = layer.istio_resources.container_resources(
+            config, "citadel", "light"
+        )
+        log_args = layer.istio_logging.istio_args(config)
+    except ValueError as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
+
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
             "serviceAccount": {
@@ -68,13 +84,22 @@ def start_charm():
                         "--monitoring-port=15014",
                         "--self-signed-ca=true",
                         "--workload-cert-ttl=2160h",
+                        *log_args,
                     ],
                     "imageDetails": {
                         "imagePath": image_info.registry_path,
                         "username": image_info.username,
                         "password": image_info.password,
                     },
-                    "config": {"CITADEL_ENABLE_NAMESPACES_BY_DEFAULT": True},
+                    "kubernetes": {"resources": resources},
+                    "config": {
+                        "CITADEL_ENABLE_NAMESPACES_BY_DEFAULT": True,
+                        **layer.istio_logging.environment(config),
+                    },
+                    "ports": [
+                        {"name": "grpc-citadel", "containerPort": 8060},
+                        {"name": "monitoring", "containerPort": 15014},
+                    ],
                 }
             ],
         }
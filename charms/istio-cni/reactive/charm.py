@@ -0,0 +1,132 @@
+import json
+import os
+
+from charmhelpers.core import hookenv
+from charms import layer
+from charms.reactive import clear_flag, hook, set_flag, when, when_any, when_not
+
+
+@hook("upgrade-charm")
+def upgrade_charm():
+    clear_flag("charm.started")
+
+
+@when("charm.started")
+def charm_ready():
+    layer.status.active("")
+
+
+@when_any("layer.docker-resource.oci-image.changed")
+def update_image():
+    clear_flag("charm.started")
+
+
+@when("config.changed")
+def config_changed():
+    clear_flag("charm.started")
+
+
+def network_config(config, namespace):
+    """Return the istio-cni plugin config that install-cni chains in.
+
+    install-cni fills in the kubeconfig path on each node.
+    """
+    excluded = [namespace] + [
+        name for name in config["exclude-namespaces"].split() if name != namespace
+    ]
+    return json.dumps(
+        {
+            "cniVersion": "0.3.1",
+            "type": "istio-cni",
+            "log_level": layer.istio_logging.level(config),
+            "kubernetes": {
+                "kubeconfig": "__KUBECONFIG_FILEPATH__",
+                "cni_bin_dir": config["cni-bin-dir"],
+                "exclude_namespaces": excluded,
+            },
+        },
+        indent=2,
+    )
+
+
+@when("layer.docker-resource.oci-image.available")
+@when_not("charm.started")
+def start_charm():
+    layer.status.maintenance("configuring container")
+
+    image_info = layer.docker_resource.get_info("oci-image")
+
+    namespace = os.environ["JUJU_MODEL_NAME"]
+
+    config = hookenv.config()
+    try:
+        resources = layer.istio_resources.container_resources(
+            config, "install-cni", "light"
+        )
+        cni_config = network_config(config, namespace)
+    except ValueError as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
+
+    # Host paths need pod spec version 3; the plugin sets up each pod's
+    # traffic redirection from the node, in place of istio-init.
+    layer.istio_pod_spec.pod_spec_set(
+        {
+            "version": 3,
+            "serviceAccount": {
+                "automountServiceAccountToken": True,
+                "roles": [
+                    {
+                        "global": True,
+                        "rules": [
+                            {
+                                "apiGroups": [""],
+                                "resources": ["pods", "nodes"],
+                                "verbs": ["get"],
+                            }
+                        ],
+                    }
+                ],
+            },
+            "containers": [
+                {
+                    "name": "install-cni",
+                    "command": ["/install-cni.sh"],
+                    "imageDetails": {
+                        "imagePath": image_info.registry_path,
+                        "username": image_info.username,
+                        "password": image_info.password,
+                    },
+                    "kubernetes": {"resources": resources},
+                    "envConfig": {
+                        "CNI_NETWORK_CONFIG": cni_config,
+                        "CNI_NET_DIR": config["cni-conf-dir"],
+                        **layer.istio_logging.environment(config),
+                    },
+                    "volumeConfig": [
+                        {
+                            "name": "cni-bin-dir",
+                            "mountPath": "/host/opt/cni/bin",
+                            "hostPath": {"path": config["cni-bin-dir"]},
+                        },
+                        {
+                            "name": "cni-net-dir",
+                            "mountPath": "/host/etc/cni/net.d",
+                            "hostPath": {"path": config["cni-conf-dir"]},
+                        },
+                    ],
+                }
+            ],
+        },
+        k8s_resources={
+            "kubernetesResources": {
+                "pod": {
+                    "hostNetwork": True,
+                    "priorityClassName": "system-node-critical",
+                }
+            }
+        },
+    )
+
+    layer.status.maintenance("creating container")
+    set_flag("charm.started")
@@ -1,7 +1,6 @@
 import os
-from pathlib import Path
-from subprocess import run
 
+from charmhelpers.core import hookenv
 from charms import layer
 from charms.reactive import clear_flag, hook, set_flag, when, when_any, when_not
 
@@ -21,7 +20,12 @@ def update_image():
     clear_flag("charm.started")
 
 
-@when("layer.docker-resource.oci-image.available")
+@when("config.changed")
+def config_changed():
+    clear_flag("charm.started")
+
+
+@when("layer.docker-resource.oci-image.available", "istio-certs.available")
 @when_not("charm.started")
 def start_charm():
     layer.status.maintenance("configuring container")
@@ -30,27 +34,24 @@ def start_charm():
 
     namespace = os.environ["JUJU_MODEL_NAME"]
 
-    run(
-        [
-            "openssl",
-            "req",
-            "-x509",
-            "-newkey",
-            "rsa:4096",
-            "-keyout",
-            "key.pem",
-            "-out",
-            "cert.pem",
-            "-days",
-            "365",
-            "-subj",
-            "/CN=localhost",
-            "-nodes",
-        ],
-        check=True,
-    )
+    cert, key = layer.istio_certs.get_certs("/CN=localhost")
+
+    config = hookenv.config()
+    try:
+        resources = layer.istio_resources.container_resources(
+            config, "istio-egressgateway", "standard"
+        )
+        concurrency = layer.istio_resources.concurrency_args(
+            config["concurrency"], resources.get("limits", {})
+        )
+        log_args = layer.istio_logging.istio_args(config)
+        proxy_log_args = layer.istio_logging.proxy_args(config)
+        tracing_args = layer.istio_zipkin.proxy_args(namespace, config)
+    except ValueError as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
 
-    layer.caas_base.pod_spec_set(
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
             "containers": [
@@ -61,7 +62,8 @@ def start_charm():
                         "router",
                         "--domain",
                         f"{namespace}.svc.cluster.local",
-                        "--log_output_level=default:info",
+                        *log_args,
+                        *proxy_log_args,
                         "--drainDuration",
                         "45s",
                         "--parentShutdownDuration",
@@ -70,8 +72,7 @@ def start_charm():
                         "10s",
                         "--serviceCluster",
                         "istio-egressgateway",
-                        "--zipkinAddress",
-                        "zipkin:9411",
+                        *tracing_args,
                         "--proxyAdminPort",
                         "15000",
                         "--statusPort",
@@ -80,12 +81,14 @@ def start_charm():
                         "NONE",
                         "--discoveryAddress",
                         "istio-pilot:15010",
+                        *concurrency,
                     ],
                     "imageDetails": {
                         "imagePath": image_info.registry_path,
                         "username": image_info.username,
                         "password": image_info.password,
                     },
+                    "kubernetes": {"resources": resources},
                     "config": {
                         "POD_NAME": "metadata.name",
                         "POD_NAMESPACE": namespace,
@@ -94,6 +97,7 @@ def start_charm():
                         "ISTIO_META_POD_NAME": "metadata.name",
                         "ISTIO_META_CONFIG_NAMESPACE": namespace,
                         "ISTIO_META_ROUTER_MODE": "sni-dnat",
+                        **layer.istio_logging.environment(config),
                     },
                     "ports": [
                         {"name": "http", "containerPort": 80},
@@ -106,24 +110,24 @@ def start_charm():
                             "name": "istio-certs",
                             "mountPath": "/etc/certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         },
                         {
                             "name": "egressgateway-certs",
                             "mountPath": "/etc/istio/egressgateway-certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         },
                         {
                             "name": "egressgateway-ca-certs",
                             "mountPath": "/etc/istio/egressgateway-ca-certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         },
                     ],
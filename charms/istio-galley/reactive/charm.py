@@ -1,12 +1,23 @@
 import os
 from pathlib import Path
-from subprocess import run
-
-import yaml
 
 from charmhelpers.core import hookenv
 from charms import layer
-from charms.reactive import clear_flag, hook, set_flag, when, when_any, when_not
+from charms.reactive import (
+    clear_flag,
+    hook,
+    is_flag_set,
+    set_flag,
+    when,
+    when_any,
+    when_not,
+)
+
+MIXER_CRD_MODES = ("auto", "enabled", "disabled")
+MIXER_GROUP = "config.istio.io"
+
+# Kinds galley leaves out by default, since it does no service discovery.
+EXCLUDED_KINDS = ["Endpoints", "Namespace", "Node", "Pod", "Service"]
 
 
 @hook("upgrade-charm")
@@ -29,7 +40,54 @@ def update_image():
     clear_flag("charm.started")
 
 
-@when("layer.docker-resource.oci-image.available")
+@when("config.changed.mixer-crds")
+def mixer_crds_changed():
+    clear_flag("charm.started")
+
+
+@when("endpoint.istio-telemetry.joined")
+@when_not("istio-galley.telemetry-related")
+def telemetry_related():
+    set_flag("istio-galley.telemetry-related")
+    clear_flag("charm.started")
+
+
+@when("istio-galley.telemetry-related")
+@when_not("endpoint.istio-telemetry.joined")
+def telemetry_unrelated():
+    clear_flag("istio-galley.telemetry-related")
+    clear_flag("charm.started")
+
+
+def mixer_crds_enabled(config):
+    mode = config["mixer-crds"]
+    if mode not in MIXER_CRD_MODES:
+        raise ValueError(f"unknown mixer-crds mode {mode!r}")
+    if mode == "auto":
+        return is_flag_set("endpoint.istio-policy.joined") or is_flag_set(
+            "endpoint.istio-telemetry.joined"
+        )
+    return mode == "enabled"
+
+
+def select_crds(crds, config):
+    """Return the CRDs to install and the kinds of those left out.
+
+    Networking, authentication and RBAC CRDs are always installed, mixer's
+    only when a mixer can use them.
+    """
+    if mixer_crds_enabled(config):
+        return crds, []
+    selected = [crd for crd in crds if crd["spec"]["group"] != MIXER_GROUP]
+    excluded = [
+        crd["spec"]["names"]["kind"]
+        for crd in crds
+        if crd["spec"]["group"] == MIXER_GROUP
+    ]
+    return selected, excluded
+
+
+@when("layer.docker-resource.oci-image.available", "istio-certs.available")
 @when_not("charm.started")
 def start_charm():
     layer.status.maintenance("configuring container")
@@ -38,66 +96,33 @@ def start_charm():
 
     namespace = os.environ["JUJU_MODEL_NAME"]
 
-    crds = yaml.safe_load_all(Path("files/crd.yaml").read_text())
-
-    run(
-        [
-            "openssl",
-            "req",
-            "-x509",
-            "-newkey",
-            "rsa:4096",
-            "-keyout",
-            "key.pem",
-            "-out",
-            "cert.pem",
-            "-days",
-            "365",
-            "-subj",
-            f"/CN={hookenv.service_name()}.{namespace}.svc",
-            "-nodes",
-        ],
-        check=True,
-    )
+    crds = layer.istio_files.load_yaml_all("files/crd.yaml")
 
-    mesh = yaml.dump(
-        {
-            "disablePolicyChecks": False,
-            "enableTracing": True,
-            "accessLogFile": "/dev/stdout",
-            "accessLogFormat": "",
-            "accessLogEncoding": "TEXT",
-            "mixerCheckServer": f"istio-policy.{namespace}.svc.cluster.local:9091",
-            "mixerReportServer": f"istio-telemetry.{namespace}.svc.cluster.local:9091",
-            "policyCheckFailOpen": False,
-            "ingressService": "istio-ingressgateway",
-            "connectTimeout": "10s",
-            "dnsRefreshRate": "5s",
-            "sdsUdsPath": None,
-            "enableSdsTokenMount": False,
-            "sdsUseK8sSaJwt": False,
-            "trustDomain": None,
-            "outboundTrafficPolicy": {"mode": "ALLOW_ANY"},
-            "localityLbSetting": {},
-            "rootNamespace": namespace,
-            "configSources": [{"address": f"istio-galley.{namespace}.svc:9901"}],
-            "defaultConfig": {
-                "connectTimeout": "10s",
-                "configPath": "/etc/istio/proxy",
-                "binaryPath": "/usr/local/bin/envoy",
-                "serviceCluster": "istio-proxy",
-                "drainDuration": "45s",
-                "parentShutdownDuration": "1m0s",
-                "proxyAdminPort": 15000,
-                "concurrency": 2,
-                "tracing": {"zipkin": {"address": f"zipkin.{namespace}:9411"}},
-                "controlPlaneAuthPolicy": "NONE",
-                "discoveryAddress": f"istio-pilot.{namespace}:15010",
-            },
-        }
+    cert, key = layer.istio_certs.get_certs(
+        f"/CN={hookenv.service_name()}.{namespace}.svc"
     )
 
-    layer.caas_base.pod_spec_set(
+    config = hookenv.config()
+    try:
+        mesh = layer.istio_mesh.build(namespace, config)
+        resources = layer.istio_resources.container_resources(
+            config, "galley", "standard"
+        )
+        log_args = layer.istio_logging.istio_args(config)
+        crds, excluded_kinds = select_crds(crds, config)
+        serve_config = layer.istio_config_source.from_galley(config)
+    except ValueError as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
+
+    # Without this galley waits for, and watches, every kind it knows of.
+    exclude_args = []
+    if excluded_kinds:
+        exclude_args = [
+            f"--excludedResourceKinds={','.join(EXCLUDED_KINDS + excluded_kinds)}"
+        ]
+
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
             "containers": [
@@ -116,13 +141,17 @@ def start_charm():
                         "--validation-webhook-config-file",
                         "/etc/config/validatingwebhookconfiguration.yaml",
                         "--monitoringPort=15014",
-                        "--log_output_level=default:info",
+                        *log_args,
+                        *exclude_args,
+                        f"--enable-server={str(serve_config).lower()}",
                     ],
                     "imageDetails": {
                         "imagePath": image_info.registry_path,
                         "username": image_info.username,
                         "password": image_info.password,
                     },
+                    "kubernetes": {"resources": resources},
+                    "config": layer.istio_logging.environment(config),
                     "ports": [
                         {"name": "validation", "containerPort": 443},
                         {"name": "monitoring", "containerPort": 15014},
@@ -132,7 +161,10 @@ def start_charm():
                         {
                             "name": "mesh-config",
                             "mountPath": "/etc/mesh-config",
-                            "files": {"mesh": mesh, "meshNetworks": "networks: {}"},
+                            "files": {
+                                "mesh": layer.istio_mesh.dump(mesh),
+                                "meshNetworks": "networks: {}",
+                            },
                         },
                         {
                             "name": "config",
@@ -147,8 +179,8 @@ def start_charm():
                             "name": "certs",
                             "mountPath": "/etc/certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         },
                     ],
@@ -1,6 +1,4 @@
 import os
-from pathlib import Path
-from subprocess import run
 
 from charms import layer
 from charms.reactive import (
@@ -29,7 +27,12 @@ def update_image():
     clear_flag("charm.started")
 
 
-@when("layer.docker-resource.oci-image.available")
+@when("config.changed")
+def config_changed():
+    clear_flag("charm.started")
+
+
+@when("layer.docker-resource.oci-image.available", "istio-certs.available")
 @when_not("charm.started")
 def start_charm():
     layer.status.maintenance("configuring container")
@@ -38,27 +41,26 @@ def start_charm():
 
     namespace = os.environ["JUJU_MODEL_NAME"]
 
-    run(
-        [
-            "openssl",
-            "req",
-            "-x509",
-            "-newkey",
-            "rsa:4096",
-            "-keyout",
-            "key.pem",
-            "-out",
-            "cert.pem",
-            "-days",
-            "365",
-            "-subj",
-            "/CN=localhost",
-            "-nodes",
-        ],
-        check=True,
-    )
+    cert, key = layer.istio_certs.get_certs("/CN=localhost")
+
+    config = hookenv.config()
+    try:
+        resources = layer.istio_resources.container_resources(
+            config, "istio-proxy", "standard"
+        )
+        concurrency = layer.istio_resources.concurrency_args(
+            config["concurrency"], resources.get("limits", {})
+        )
+        log_args = layer.istio_logging.istio_args(config)
+        proxy_log_args = layer.istio_logging.proxy_args(config)
+        autoscaler = layer.istio_autoscaler.k8s_resources(
+            config, "Deployment", [resources.get("requests", {})]
+        )
+    except ValueError as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
 
-    layer.caas_base.pod_spec_set(
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
             "containers": [
@@ -69,7 +71,8 @@ def start_charm():
                         "router",
                         "--domain",
                         f"{namespace}.svc.cluster.local",
-                        "--log_output_level=all:debug",
+                        *log_args,
+                        *proxy_log_args,
                         "--drainDuration",
                         "45s",
                         "--parentShutdownDuration",
@@ -88,12 +91,14 @@ def start_charm():
                         "NONE",
                         "--discoveryAddress",
                         "istio-pilot:15010",
+                        *concurrency,
                     ],
                     "imageDetails": {
                         "imagePath": image_info.registry_path,
                         "username": image_info.username,
                         "password": image_info.password,
                     },
+                    "kubernetes": {"resources": resources},
                     "config": {
                         "NODE_NAME": {
                             "field": {"path": "spec.nodeName", "api-version": "v1"}
@@ -122,6 +127,7 @@ def start_charm():
                         "ISTIO_META_WORKLOAD_NAME": hookenv.service_name(),
                         "ISTIO_META_OWNER": f"kubernetes://api/apps/v1/namespaces/{namespace}/deployments/istio-ingressgateway",
                         "ISTIO_META_ROUTER_MODE": "sni-dnat",
+                        **layer.istio_logging.environment(config),
                     },
                     "ports": [
                         {"name": "status-port", "containerPort": 15020},
@@ -145,30 +151,31 @@ def start_charm():
                             "name": "istio-certs",
                             "mountPath": "/etc/certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         },
                         {
                             "name": "ingressgateway-certs",
                             "mountPath": "/etc/istio/ingressgateway-certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         },
                         {
                             "name": "ingressgateway-ca-certs",
                             "mountPath": "/etc/istio/ingressgateway-ca-certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         },
                     ],
                 }
             ],
-        }
+        },
+        k8s_resources=autoscaler,
     )
 
     layer.status.maintenance("creating container")
@@ -1,6 +1,5 @@
 import os
-from pathlib import Path
-from subprocess import run
+import re
 
 import yaml
 
@@ -8,6 +7,47 @@ from charmhelpers.core import hookenv
 from charms import layer
 from charms.reactive import clear_flag, hook, set_flag, when, when_any, when_not
 
+# xDS push tuning. Pushes are debounced until no change has been seen for
+# debounce-after, or for at most debounce-max, and at most push-throttle
+# proxies are pushed to concurrently.
+PUSH_PROFILES = {
+    "default": {
+        "push-throttle": 100,
+        "debounce-after": "100ms",
+        "debounce-max": "10s",
+        "eds-debounce": True,
+        "keepalive-max-server-connection-age": "30m",
+    },
+    # A few dozen proxies: push quickly, keep pilot's footprint down.
+    "small": {
+        "push-throttle": 25,
+        "debounce-after": "50ms",
+        "debounce-max": "5s",
+        "eds-debounce": True,
+        "keepalive-max-server-connection-age": "30m",
+    },
+    # Thousands of proxies: push wider, coalesce more and recycle
+    # connections sooner so they spread over new pilot replicas.
+    "large-mesh": {
+        "push-throttle": 250,
+        "debounce-after": "500ms",
+        "debounce-max": "30s",
+        "eds-debounce": True,
+        "keepalive-max-server-connection-age": "15m",
+    },
+    # Frequent rollouts: wait for bursts of changes to settle before a
+    # full push.
+    "high-churn": {
+        "push-throttle": 100,
+        "debounce-after": "1s",
+        "debounce-max": "20s",
+        "eds-debounce": True,
+        "keepalive-max-server-connection-age": "30m",
+    },
+}
+
+DURATION = re.compile(r"^(\d+(\.\d+)?(ns|us|ms|s|m|h))+$")
+
 
 @hook("upgrade-charm")
 def upgrade_charm():
@@ -32,9 +72,74 @@ def update_image():
     clear_flag("charm.started")
 
 
+@when("config.changed")
+def config_changed():
+    clear_flag("charm.started")
+
+
+def push_settings(config):
+    """Return the xDS push settings of the configured profile.
+
+    Options left at their empty default keep the profile's value.
+    """
+    profile = config["push-profile"]
+    if profile not in PUSH_PROFILES:
+        raise ValueError(f"unknown push-profile {profile!r}")
+    settings = dict(PUSH_PROFILES[profile])
+
+    if config["push-throttle"]:
+        settings["push-throttle"] = config["push-throttle"]
+    if settings["push-throttle"] < 1:
+        raise ValueError("push-throttle must be positive")
+    durations = ("debounce-after", "debounce-max", "keepalive-max-server-connection-age")
+    for key in durations:
+        if config[key]:
+            settings[key] = config[key]
+        if not DURATION.match(settings[key]):
+            raise ValueError(f"invalid duration for {key}: {settings[key]!r}")
+    if config["eds-debounce"]:
+        if config["eds-debounce"] not in ("true", "false"):
+            raise ValueError("eds-debounce must be true, false or empty")
+        settings["eds-debounce"] = config["eds-debounce"] == "true"
+    return settings
+
+
+def sidecars(namespace, config):
+    """Return the mesh-wide default Sidecar limiting the hosts proxies see.
+
+    It is created in the root namespace, ``namespace``, the only one Juju
+    creates resources in.
+    """
+    egress = yaml.safe_load(config["sidecar-egress-hosts"]) or {}
+    if not isinstance(egress, dict) or not all(
+        isinstance(hosts, list) for hosts in egress.values()
+    ):
+        raise ValueError("sidecar-egress-hosts must map * to a list of hosts")
+    if set(egress) - {"*"}:
+        raise ValueError("sidecar-egress-hosts only supports the * entry")
+    if not egress:
+        return []
+
+    hosts = egress["*"]
+    for host in hosts:
+        if not isinstance(host, str) or host.count("/") != 1:
+            raise ValueError(f"egress host must be <namespace>/<host>: {host!r}")
+    scope = ["./*", f"{namespace}/*"]
+    hosts = scope + [host for host in hosts if host not in scope]
+    return [
+        {
+            "apiVersion": "networking.istio.io/v1alpha3",
+            "kind": "Sidecar",
+            "metadata": {"name": "default"},
+            "spec": {"egress": [{"hosts": hosts}]},
+        }
+    ]
+
+
 @when(
     "layer.docker-resource.pilot-image.available",
     "layer.docker-resource.proxy-image.available",
+    "istio-certs.available",
 )
 @when_not("charm.started")
 def start_charm():
@@ -45,95 +150,88 @@ def start_charm():
 
     namespace = os.environ["JUJU_MODEL_NAME"]
 
-    run(
-        [
-            "openssl",
-            "req",
-            "-x509",
-            "-newkey",
-            "rsa:4096",
-            "-keyout",
-            "key.pem",
-            "-out",
-            "cert.pem",
-            "-days",
-            "365",
-            "-subj",
-            f"/CN={hookenv.service_name()}",
-            "-nodes",
-        ],
-        check=True,
-    )
+    cert, key = layer.istio_certs.get_certs(f"/CN={hookenv.service_name()}")
 
-    mesh = yaml.dump(
-        {
-            "disablePolicyChecks": False,
-            "enableTracing": True,
-            "accessLogFile": "/dev/stdout",
-            "accessLogFormat": "",
-            "accessLogEncoding": "TEXT",
-            "mixerCheckServer": f"istio-policy.{namespace}.svc.cluster.local:9091",
-            "mixerReportServer": f"istio-telemetry.{namespace}.svc.cluster.local:9091",
-            "policyCheckFailOpen": False,
-            "ingressService": "istio-ingressgateway",
-            "connectTimeout": "10s",
-            "dnsRefreshRate": "5s",
-            "sdsUdsPath": None,
-            "enableSdsTokenMount": False,
-            "sdsUseK8sSaJwt": False,
-            "trustDomain": None,
-            "outboundTrafficPolicy": {"mode": "ALLOW_ANY"},
-            "localityLbSetting": {},
-            "rootNamespace": namespace,
-            "configSources": [{"address": f"istio-galley.{namespace}.svc:9901"}],
-            "defaultConfig": {
-                "connectTimeout": "10s",
-                "configPath": "/etc/istio/proxy",
-                "binaryPath": "/usr/local/bin/envoy",
-                "serviceCluster": "istio-proxy",
-                "drainDuration": "45s",
-                "parentShutdownDuration": "1m0s",
-                "proxyAdminPort": 15000,
-                "concurrency": 2,
-                "tracing": {"zipkin": {"address": f"zipkin.{namespace}:9411"}},
-                "controlPlaneAuthPolicy": "NONE",
-                "discoveryAddress": f"{hookenv.service_name()}.{namespace}:15010",
-            },
-        }
-    )
+    config = hookenv.config()
+    try:
+        push = push_settings(config)
+        mesh = layer.istio_mesh.build(
+            namespace,
+            config,
+            pilot=f"{hookenv.service_name()}.{namespace}:15010",
+        )
+        discovery_resources = layer.istio_resources.container_resources(
+            config, "discovery", "heavy"
+        )
+        proxy_resources = layer.istio_resources.container_resources(
+            config, "istio-proxy", "light"
+        )
+        k8s_resources = layer.istio_autoscaler.k8s_resources(
+            config,
+            "Deployment",
+            [
+                discovery_resources.get("requests", {}),
+                proxy_resources.get("requests", {}),
+            ],
+        )
+        access_log_filter = layer.istio_mesh.access_log_envoy_filter(config)
+        sidecar_resources = sidecars(namespace, config)
+        log_args = layer.istio_logging.istio_args(config)
+        proxy_log_args = layer.istio_logging.proxy_args(config)
+        trace_sampling = layer.istio_zipkin.sampling(config)
+        service_account = layer.istio_config_source.service_account(
+            config, layer.istio_config_source.PILOT_RULES
+        )
+    except (yaml.YAMLError, ValueError) as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
+
+    custom_resources = {}
+    if access_log_filter:
+        custom_resources["envoyfilters.networking.istio.io"] = [access_log_filter]
+    if sidecar_resources:
+        custom_resources["sidecars.networking.istio.io"] = sidecar_resources
+    if custom_resources:
+        k8s_resources = k8s_resources or {"kubernetesResources": {}}
+        k8s_resources["kubernetesResources"]["customResources"] = custom_resources
 
-    layer.caas_base.pod_spec_set(
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
+            **service_account,
             "containers": [
                 {
                     "name": "discovery",
                     "args": [
                         "discovery",
                         "--monitoringAddr=:15014",
-                        "--log_output_level=all:debug",
+                        *log_args,
                         "--domain",
                         "cluster.local",
                         "--secureGrpcAddr",
                         "",
                         "--keepaliveMaxServerConnectionAge",
-                        "30m",
+                        push["keepalive-max-server-connection-age"],
                     ],
                     "imageDetails": {
                         "imagePath": pilot_image.registry_path,
                         "username": pilot_image.username,
                         "password": pilot_image.password,
                     },
+                    "kubernetes": {"resources": discovery_resources},
                     "config": {
                         "POD_NAME": {
                             "field": {"path": "metadata.name", "api-version": "v1"}
                         },
                         "POD_NAMESPACE": namespace,
-                        "GODEBUG": "gctrace=1",
-                        "PILOT_PUSH_THROTTLE": "100",
-                        "PILOT_TRACE_SAMPLING": "1",
+                        "PILOT_PUSH_THROTTLE": str(push["push-throttle"]),
+                        "PILOT_DEBOUNCE_AFTER": push["debounce-after"],
+                        "PILOT_DEBOUNCE_MAX": push["debounce-max"],
+                        "PILOT_ENABLE_EDS_DEBOUNCE": push["eds-debounce"],
+                        "PILOT_TRACE_SAMPLING": str(trace_sampling),
                         "PILOT_ENABLE_PROTOCOL_SNIFFING_FOR_OUTBOUND": True,
                         "PILOT_ENABLE_PROTOCOL_SNIFFING_FOR_INBOUND": False,
+                        **layer.istio_logging.environment(config),
                     },
                     "ports": [
                         {"name": "http-leg-disc", "containerPort": 8080},
@@ -144,14 +242,17 @@ def start_charm():
                         {
                             "name": "config-volume",
                             "mountPath": "/etc/istio/config",
-                            "files": {"mesh": mesh, "meshNetworks": "networks: {}"},
+                            "files": {
+                                "mesh": layer.istio_mesh.dump(mesh),
+                                "meshNetworks": "networks: {}",
+                            },
                         },
                         {
                             "name": "istio-certs1",
                             "mountPath": "/etc/certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         },
                     ],
@@ -168,12 +269,15 @@ def start_charm():
                         "/etc/istio/proxy/envoy_pilot.yaml.tmpl",
                         "--controlPlaneAuthPolicy",
                         "NONE",
+                        *log_args,
+                        *proxy_log_args,
                     ],
                     "imageDetails": {
                         "imagePath": proxy_image.registry_path,
                         "username": proxy_image.username,
                         "password": proxy_image.password,
                     },
+                    "kubernetes": {"resources": proxy_resources},
                     "config": {
                         "POD_NAME": {
                             "field": {"path": "metadata.name", "api-version": "v1"}
@@ -184,6 +288,7 @@ def start_charm():
                         },
                         "SDS_ENABLED": False,
                         "NODE_NAMESPACE": namespace,
+                        **layer.istio_logging.environment(config),
                     },
                     "ports": [
                         {"name": "http-1", "containerPort": 15003},
@@ -196,15 +301,16 @@ def start_charm():
                             "name": "istio-certs",
                             "mountPath": "/etc/certs",
                             "files": {
-                                "root-cert.pem": Path("cert.pem").read_text(),
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "root-cert.pem": cert,
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         }
                     ],
                 },
             ],
-        }
+        },
+        k8s_resources=k8s_resources,
     )
 
     layer.status.maintenance("creating container")
@@ -1,6 +1,4 @@
 import os
-from pathlib import Path
-from subprocess import run
 
 from charms import layer
 from charms.reactive import (
@@ -24,6 +22,16 @@ def charm_ready():
     layer.status.active("")
 
 
+@when("config.changed.check-cache-entries")
+def check_cache_entries_changed():
+    clear_flag("charm.started")
+
+
+@when("istio-policy.available")
+def configure_http(http):
+    http.configure(port=9091, hostname=hookenv.application_name())
+
+
 @when_any(
     "layer.docker-resource.mixer-image.changed",
     "layer.docker-resource.proxy-image.changed",
@@ -35,6 +43,7 @@ def update_image():
 @when(
     "layer.docker-resource.mixer-image.available",
     "layer.docker-resource.proxy-image.available",
+    "istio-certs.available",
 )
 @when_not("charm.started")
 def start_charm():
@@ -45,29 +54,48 @@ def start_charm():
 
     namespace = os.environ["JUJU_MODEL_NAME"]
 
-    run(
-        [
-            "openssl",
-            "req",
-            "-x509",
-            "-newkey",
-            "rsa:4096",
-            "-keyout",
-            "key.pem",
-            "-out",
-            "cert.pem",
-            "-days",
-            "365",
-            "-subj",
-            "/CN=localhost",
-            "-nodes",
-        ],
-        check=True,
-    )
+    cert, key = layer.istio_certs.get_certs("/CN=localhost")
+
+    config = hookenv.config()
+    try:
+        if config["check-cache-entries"] < 0:
+            raise ValueError("check-cache-entries must not be negative")
+        mixer_resources = layer.istio_resources.container_resources(
+            config, "mixer", "heavy"
+        )
+        proxy_resources = layer.istio_resources.container_resources(
+            config, "proxy", "light"
+        )
+        # Juju runs charms with storage as a StatefulSet.
+        autoscaler = layer.istio_autoscaler.k8s_resources(
+            config,
+            "StatefulSet",
+            [
+                mixer_resources.get("requests", {}),
+                proxy_resources.get("requests", {}),
+            ],
+        )
+        load_shedding = layer.istio_mixer.load_shedding_args(config)
+        log_args = layer.istio_logging.istio_args(config)
+        proxy_log_args = layer.istio_logging.proxy_args(config)
+        tracing_args = layer.istio_zipkin.mixer_args(namespace, config)
+        store_url = layer.istio_config_source.mixer_store_url(
+            config, f"istio-galley.{namespace}.svc:9901"
+        )
+        service_account = layer.istio_config_source.service_account(
+            config, layer.istio_config_source.MIXER_RULES
+        )
+        mixer_env = layer.istio_mixer.environment(
+            config, mixer_resources.get("limits", {})
+        )
+    except ValueError as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
 
-    layer.caas_base.pod_spec_set(
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
+            **service_account,
             "containers": [
                 {
                     "name": "mixer",
@@ -75,19 +103,25 @@ def start_charm():
                         "--monitoringPort=15014",
                         "--address",
                         "unix:///sock/mixer.socket",
-                        "--log_output_level=default:info",
-                        f"--configStoreURL=mcp://istio-galley.{namespace}.svc:9901",
+                        *log_args,
+                        f"--configStoreURL={store_url}",
                         f"--configDefaultNamespace={namespace}",
                         "--useAdapterCRDs=false",
                         "--useTemplateCRDs=false",
-                        "--trace_zipkin_url=http://zipkin:9411/api/v1/spans",
+                        *tracing_args,
+                        f"--numCheckCacheEntries={config['check-cache-entries']}",
+                        *load_shedding,
                     ],
                     "imageDetails": {
                         "imagePath": mixer_image.registry_path,
                         "username": mixer_image.username,
                         "password": mixer_image.password,
                     },
-                    "config": {"GODEBUG": "gctrace=1", "GOMAXPROCS": "6"},
+                    "kubernetes": {"resources": mixer_resources},
+                    "config": {
+                        **layer.istio_logging.environment(config),
+                        **mixer_env,
+                    },
                     "ports": [
                         {"name": "monitoring", "containerPort": 15014},
                         {"name": "prometheus", "containerPort": 42422},
@@ -97,8 +131,8 @@ def start_charm():
                             "name": "istio-certs1",
                             "mountPath": "/etc/certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         }
                     ],
@@ -115,6 +149,8 @@ def start_charm():
                         "/etc/istio/proxy/envoy_policy.yaml.tmpl",
                         "--controlPlaneAuthPolicy",
                         "NONE",
+                        *log_args,
+                        *proxy_log_args,
                     ],
                     "config": {
                         "POD_NAME": {"field": {"path": "metadata.name", "api-version": "v1"}},
@@ -123,12 +159,14 @@ def start_charm():
                             "field": {"path": "status.PodIP", "api-version": "v1"}
                         },
                         "SDS_ENABLED": False,
+                        **layer.istio_logging.environment(config),
                     },
                     "imageDetails": {
                         "imagePath": proxy_image.registry_path,
                         "username": proxy_image.username,
                         "password": proxy_image.password,
                     },
+                    "kubernetes": {"resources": proxy_resources},
                     "ports": [
                         {"name": "grpc-mixer", "containerPort": 9091},
                         {"name": "grpc-mixer-mtls", "containerPort": 15004},
@@ -143,9 +181,9 @@ def start_charm():
                             "name": "istio-certs2",
                             "mountPath": "/etc/certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "root-cert.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "root-cert.pem": cert,
+                                "key.pem": key,
                             },
                         },
                         {
@@ -156,7 +194,8 @@ def start_charm():
                     ],
                 },
             ],
-        }
+        },
+        k8s_resources=autoscaler,
     )
 
     layer.status.maintenance("creating container")
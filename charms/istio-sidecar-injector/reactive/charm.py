@@ -1,7 +1,7 @@
+import json
 import os
+import re
 from base64 import b64encode
-from pathlib import Path
-from subprocess import run
 
 import yaml
 
@@ -17,6 +17,48 @@ from charms.reactive import (
     when_not,
 )
 
+# Kubernetes namespace names are DNS-1123 labels. Checking override keys
+# against it also keeps them from breaking the injection template they are
+# written into.
+NAMESPACE = re.compile(r"^[a-z0-9]([-a-z0-9]{0,61}[a-z0-9])?$")
+
+# Pod annotations read by the proxy to select which Envoy stats to keep.
+STATS_ANNOTATIONS = {
+    "prefixes": "sidecar.istio.io/statsInclusionPrefixes",
+    "suffixes": "sidecar.istio.io/statsInclusionSuffixes",
+    "regexps": "sidecar.istio.io/statsInclusionRegexps",
+}
+
+STATS_PRESETS = {
+    # Leave the proxy's built-in defaults alone.
+    "": {},
+    # Only what the bundled dashboards and health checks need.
+    "minimal": {
+        "prefixes": "cluster_manager,listener_manager,server,cluster.xds-grpc"
+    },
+    "full": {"regexps": ".*"},
+}
+
+# The injection template hands the pod's annotations to the proxy through
+# this environment variable; it is replaced to merge in the defaults above.
+ANNOTATIONS_ENV = """\
+  {{ if .ObjectMeta.Annotations }}
+  - name: ISTIO_METAJSON_ANNOTATIONS
+    value: |
+           {{ toJSON .ObjectMeta.Annotations }}
+  {{ end }}
+"""
+
+FAILURE_POLICIES = ("Fail", "Ignore")
+
+# Proxy worker threads, from the mesh's defaultConfig.concurrency.
+CONCURRENCY_ARGS = """\
+  {{ if gt .ProxyConfig.Concurrency 0 -}}
+  - --concurrency
+  - "{{ .ProxyConfig.Concurrency }}"
+  {{ end -}}
+"""
+
 
 @hook("upgrade-charm")
 def upgrade_charm():
@@ -33,39 +75,265 @@ def update_image():
     clear_flag("charm.started")
 
 
-@when("layer.docker-resource.oci-image.available", "istio-galley.available")
+@when("config.changed")
+def config_changed():
+    clear_flag("charm.started")
+
+
+@when("istio-galley.available")
+@when_not("istio-sidecar-injector.galley-related")
+def galley_related():
+    set_flag("istio-sidecar-injector.galley-related")
+    clear_flag("charm.started")
+
+
+@when("istio-sidecar-injector.galley-related")
+@when_not("istio-galley.available")
+def galley_unrelated():
+    clear_flag("istio-sidecar-injector.galley-related")
+    clear_flag("charm.started")
+
+
+def _check_namespaces(overrides, key):
+    for namespace in overrides:
+        if not isinstance(namespace, str) or not NAMESPACE.match(namespace):
+            raise ValueError(f"{key} has invalid namespace {namespace!r}")
+
+
+def _stats_setting(setting):
+    if isinstance(setting, str):
+        if setting not in STATS_PRESETS:
+            raise ValueError(f"unknown stats preset {setting!r}")
+        return dict(STATS_PRESETS[setting])
+    if not isinstance(setting, dict) or set(setting) - set(STATS_ANNOTATIONS):
+        raise ValueError(f"invalid stats setting {setting!r}")
+    return {kind: str(value) for kind, value in setting.items()}
+
+
+def stats_inclusion(config):
+    """Return the default and per-namespace stats inclusion settings."""
+    defaults = _stats_setting(config["stats-preset"])
+    for kind in STATS_ANNOTATIONS:
+        if config[f"stats-inclusion-{kind}"]:
+            defaults[kind] = config[f"stats-inclusion-{kind}"]
+
+    overrides = yaml.safe_load(config["stats-namespace-overrides"]) or {}
+    if not isinstance(overrides, dict):
+        raise ValueError("stats-namespace-overrides must be a mapping")
+    _check_namespaces(overrides, "stats-namespace-overrides")
+    overrides = {ns: _stats_setting(setting) for ns, setting in overrides.items()}
+    return defaults, overrides
+
+
+def render_stats_annotations(template, defaults, overrides):
+    """Make the injection template default the stats inclusion annotations.
+
+    An annotation set on the pod always wins. Otherwise the namespace
+    override, if any, and then the default value is used. A kind with no
+    value there is left out.
+    """
+    kinds = [
+        kind
+        for kind in STATS_ANNOTATIONS
+        if kind in defaults or any(kind in o for o in overrides.values())
+    ]
+    if not kinds:
+        return template
+    if ANNOTATIONS_ENV not in template:
+        raise ValueError("injection template has no ISTIO_METAJSON_ANNOTATIONS")
+
+    # $sep puts commas only between the entries actually written, so a
+    # kind without a value is left out rather than set to "".
+    def entry(key, value):
+        return f'{{{{ $sep }}}}{key}: {value}{{{{ $sep = ", " }}}}'
+
+    def setting_entry(setting, kind):
+        if kind not in setting:
+            return ""
+        return entry(json.dumps(STATS_ANNOTATIONS[kind]), json.dumps(setting[kind]))
+
+    keys = " ".join(f"`{STATS_ANNOTATIONS[kind]}`" for kind in kinds)
+    entries = []
+    for kind in kinds:
+        key = STATS_ANNOTATIONS[kind]
+        annotation = f"(index $.ObjectMeta.Annotations `{key}`)"
+        value = f"{{{{ if isset $.ObjectMeta.Annotations `{key}` }}}}" + entry(
+            json.dumps(key), f"{{{{ toJSON {annotation} }}}}"
+        )
+        for namespace, setting in sorted(overrides.items()):
+            value += (
+                f"{{{{ else if eq $.DeploymentMeta.Namespace `{namespace}` }}}}"
+                + setting_entry(setting, kind)
+            )
+        value += "{{ else }}" + setting_entry(defaults, kind) + "{{ end }}"
+        entries.append(value)
+
+    annotations = (
+        '{ {{- $sep := "" }}{{ range $key, $value := .ObjectMeta.Annotations }}'
+        f"{{{{ if not (eq $key {keys}) }}}}"
+        + entry("{{ toJSON $key }}", "{{ toJSON $value }}")
+        + "{{ end }}{{ end }}"
+        + "".join(entries)
+        + " }"
+    )
+    return template.replace(
+        ANNOTATIONS_ENV,
+        "  - name: ISTIO_METAJSON_ANNOTATIONS\n"
+        "    value: |\n"
+        f"           {annotations}\n",
+    )
+
+
+def concurrency_overrides(config):
+    """Return the per-namespace proxy concurrency overrides."""
+    overrides = yaml.safe_load(config["proxy-concurrency-overrides"]) or {}
+    if not isinstance(overrides, dict) or not all(
+        isinstance(value, int) and value >= 0 for value in overrides.values()
+    ):
+        raise ValueError(
+            "proxy-concurrency-overrides must map namespaces to worker counts"
+        )
+    _check_namespaces(overrides, "proxy-concurrency-overrides")
+    return overrides
+
+
+def render_concurrency(template, overrides):
+    """Make the injection template apply per-namespace proxy concurrency.
+
+    Namespaces without an override keep the mesh-wide default. An override
+    of 0 leaves it to Envoy, which starts one worker per core.
+    """
+    if not overrides:
+        return template
+    if CONCURRENCY_ARGS not in template:
+        raise ValueError("injection template has no --concurrency argument")
+
+    conditions = []
+    for namespace, concurrency in sorted(overrides.items()):
+        args = f'  - --concurrency\n  - "{concurrency}"\n' if concurrency else ""
+        conditions.append(
+            f"if eq $.DeploymentMeta.Namespace `{namespace}` -}}}}\n{args}"
+        )
+    # The mesh-wide default becomes the final else branch.
+    conditions.append(CONCURRENCY_ARGS[len("  {{ ") : -len("  {{ end -}}\n")])
+    return template.replace(
+        CONCURRENCY_ARGS, "  {{ " + "  {{ else ".join(conditions) + "  {{ end -}}\n"
+    )
+
+
+def _selectors(config, key):
+    selectors = yaml.safe_load(config[key]) or []
+    if not isinstance(selectors, list) or not all(
+        isinstance(selector, dict) for selector in selectors
+    ):
+        raise ValueError(f"{key} must be a list of label selectors")
+    return selectors
+
+
+def inject_selectors(config):
+    """Return the injection config's always and never inject selectors."""
+    return {
+        "alwaysInjectSelector": _selectors(config, "always-inject-selector"),
+        "neverInjectSelector": _selectors(config, "never-inject-selector"),
+    }
+
+
+def webhook(config, namespace, ca_bundle):
+    """Return the injector's MutatingWebhookConfiguration webhook."""
+    if not 1 <= config["webhook-timeout"] <= 30:
+        raise ValueError("webhook-timeout must be between 1 and 30")
+    if config["webhook-failure-policy"] not in FAILURE_POLICIES:
+        raise ValueError(
+            f"unknown webhook-failure-policy {config['webhook-failure-policy']!r}"
+        )
+    object_selector = yaml.safe_load(config["webhook-object-selector"])
+    if object_selector is not None and not isinstance(object_selector, dict):
+        raise ValueError("webhook-object-selector must be a label selector")
+
+    hook = {
+        "name": "sidecar-injector.istio.io",
+        "clientConfig": {
+            "service": {
+                "name": hookenv.service_name(),
+                "namespace": namespace,
+                "path": "/inject",
+            },
+            "caBundle": ca_bundle,
+        },
+        "rules": [
+            {
+                "operations": ["CREATE"],
+                "apiGroups": [""],
+                "apiVersions": ["v1"],
+                "resources": ["pods"],
+            }
+        ],
+        "failurePolicy": config["webhook-failure-policy"],
+        "timeoutSeconds": config["webhook-timeout"],
+        "namespaceSelector": {"matchLabels": {"istio-injection": "enabled"}},
+    }
+    if object_selector:
+        hook["objectSelector"] = object_selector
+    return hook
+
+
+@when("layer.docker-resource.oci-image.available", "istio-certs.available")
 @when_not("charm.started")
 def start_charm():
     layer.status.maintenance("configuring container")
 
     image_info = layer.docker_resource.get_info("oci-image")
 
-    galley = endpoint_from_name("istio-galley").services()[0]["hosts"][0]
-
     namespace = os.environ["JUJU_MODEL_NAME"]
 
-    run(
-        [
-            "openssl",
-            "req",
-            "-x509",
-            "-newkey",
-            "rsa:4096",
-            "-keyout",
-            "key.pem",
-            "-out",
-            "cert.pem",
-            "-days",
-            "365",
-            "-subj",
-            f"/CN={hookenv.service_name()}.{namespace}.svc",
-            "-nodes",
-        ],
-        check=True,
+    config = hookenv.config()
+
+    cert, key = layer.istio_certs.get_certs(
+        f"/CN={hookenv.service_name()}.{namespace}.svc"
     )
-    ca_bundle = b64encode(Path("cert.pem").read_bytes()).decode("utf-8")
+    ca_bundle = b64encode(cert.encode("utf-8")).decode("utf-8")
+
+    inject_config = layer.istio_files.load_yaml("files/inject-config.yaml")
+    inject_values = layer.istio_files.load_json("files/inject-values.json")
+    inject_values["istio_cni"]["enabled"] = config["install-cni"]
+
+    try:
+        # istio-galley is only needed when pilot reads config from it.
+        galley = None
+        services = endpoint_from_name("istio-galley").services()
+        if services:
+            host = services[0]["hosts"][0]
+            galley = f"{host['hostname']}.{namespace}.svc:{host['port']}"
+        elif layer.istio_config_source.from_galley(config):
+            layer.status.waiting("waiting for istio-galley")
+            return
+        inject_config["template"] = render_stats_annotations(
+            inject_config["template"], *stats_inclusion(config)
+        )
+        inject_config["template"] = render_concurrency(
+            inject_config["template"], concurrency_overrides(config)
+        )
+        mesh = layer.istio_mesh.build(
+            namespace,
+            config,
+            galley=galley,
+        )
+        inject_config.update(inject_selectors(config))
+        resources = layer.istio_resources.container_resources(
+            config, "sidecar-injector-webhook", "standard"
+        )
+        k8s_resources = layer.istio_autoscaler.k8s_resources(
+            config, "Deployment", [resources.get("requests", {})]
+        ) or {"kubernetesResources": {}}
+        k8s_resources["kubernetesResources"]["mutatingWebhookConfigurations"] = {
+            "sidecar-injector": [webhook(config, namespace, ca_bundle)]
+        }
+        log_args = layer.istio_logging.istio_args(config)
+    except (yaml.YAMLError, ValueError) as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
 
-    layer.caas_base.pod_spec_set(
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
             "serviceAccount": {
@@ -94,12 +362,15 @@ def start_charm():
                         "--meshConfig=/etc/istio/config/mesh",
                         "--healthCheckInterval=2s",
                         "--healthCheckFile=/health",
+                        *log_args,
                     ],
                     "imageDetails": {
                         "imagePath": image_info.registry_path,
                         "username": image_info.username,
                         "password": image_info.password,
                     },
+                    "kubernetes": {"resources": resources},
+                    "config": layer.istio_logging.environment(config),
                     "ports": [
                         {"name": "validation", "containerPort": 443},
                         {"name": "monitoring", "containerPort": 15014},
@@ -110,53 +381,7 @@ def start_charm():
                             "name": "config-volume",
                             "mountPath": "/etc/istio/config",
                             "files": {
-                                "mesh": yaml.dump(
-                                    {
-                                        "disablePolicyChecks": True,
-                                        "reportBatchMaxEntries": 100,
-                                        "reportBatchMaxTime": "1s",
-                                        "enableTracing": False,
-                                        "accessLogFile": "/dev/stdout",
-                                        "accessLogFormat": "",
-                                        "accessLogEncoding": "TEXT",
-                                        "enableEnvoyAccessLogService": False,
-                                        "mixerCheckServer": f"istio-policy.{namespace}.svc.cluster.local:9091",
-                                        "mixerReportServer": f"istio-telemetry.{namespace}.svc.cluster.local:9091",
-                                        "policyCheckFailOpen": False,
-                                        "ingressService": "istio-ingressgateway",
-                                        "connectTimeout": "10s",
-                                        "protocolDetectionTimeout": "100ms",
-                                        "dnsRefreshRate": "300s",
-                                        "sdsUdsPath": "unix:/var/run/sds/uds_path",
-                                        "trustDomain": "",
-                                        "outboundTrafficPolicy": {"mode": "ALLOW_ANY"},
-                                        "localityLbSetting": {"enabled": True},
-                                        "rootNamespace": namespace,
-                                        "configSources": [
-                                            {
-                                                "address": f"{galley['hostname']}.{namespace}.svc:{galley['port']}",
-                                                # "tlsSettings": {"mode": "NONE"},
-                                            }
-                                        ],
-                                        "defaultConfig": {
-                                            "connectTimeout": "10s",
-                                            "configPath": "/etc/istio/proxy",
-                                            "binaryPath": "/usr/local/bin/envoy",
-                                            "serviceCluster": "istio-proxy",
-                                            "drainDuration": "45s",
-                                            "parentShutdownDuration": "1m0s",
-                                            "proxyAdminPort": 15000,
-                                            "concurrency": 2,
-                                            "tracing": {
-                                                "zipkin": {
-                                                    "address": f"zipkin.{namespace}:9411"
-                                                }
-                                            },
-                                            "controlPlaneAuthPolicy": "NONE",
-                                            "discoveryAddress": f"istio-pilot.{namespace}:15010",
-                                        },
-                                    }
-                                ),
+                                "mesh": layer.istio_mesh.dump(mesh),
                                 "meshNetworks": "networks: {}",
                             },
                         },
@@ -164,54 +389,24 @@ def start_charm():
                             "name": "certs",
                             "mountPath": "/etc/istio/certs",
                             "files": {
-                                "root-cert.pem": Path("cert.pem").read_text(),
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "root-cert.pem": cert,
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         },
                         {
                             "name": "inject",
                             "mountPath": "/etc/istio/inject",
                             "files": {
-                                "config": Path("files/inject-config.yaml").read_text(),
-                                "values": Path("files/inject-values.json").read_text(),
+                                "config": layer.istio_files.dump_yaml(inject_config),
+                                "values": json.dumps(inject_values),
                             },
                         },
                     ],
                 }
             ],
         },
-        k8s_resources={
-            "kubernetesResources": {
-                "mutatingWebhookConfigurations": {
-                    "sidecar-injector": [
-                        {
-                            "name": "sidecar-injector.istio.io",
-                            "clientConfig": {
-                                "service": {
-                                    "name": hookenv.service_name(),
-                                    "namespace": namespace,
-                                    "path": "/inject",
-                                },
-                                "caBundle": ca_bundle,
-                            },
-                            "rules": [
-                                {
-                                    "operations": ["CREATE"],
-                                    "apiGroups": [""],
-                                    "apiVersions": ["v1"],
-                                    "resources": ["pods"],
-                                }
-                            ],
-                            "failurePolicy": "Fail",
-                            "namespaceSelector": {
-                                "matchLabels": {"istio-injection": "enabled"}
-                            },
-                        }
-                    ],
-                }
-            }
-        },
+        k8s_resources=k8s_resources,
     )
 
     layer.status.maintenance("creating container")
@@ -1,7 +1,6 @@
 import os
-from pathlib import Path
-from subprocess import run
 
+from charmhelpers.core import hookenv
 from charms import layer
 from charms.reactive import clear_flag, hook, set_flag, when, when_any, when_not
 
@@ -16,6 +15,11 @@ def charm_ready():
     layer.status.active("")
 
 
+@when("istio-telemetry.available")
+def configure_http(http):
+    http.configure(port=9091, hostname=hookenv.application_name())
+
+
 @when_any(
     "layer.docker-resource.mixer-image.changed",
     "layer.docker-resource.proxy-image.changed",
@@ -27,6 +31,7 @@ def update_image():
 @when(
     "layer.docker-resource.mixer-image.available",
     "layer.docker-resource.proxy-image.available",
+    "istio-certs.available",
 )
 @when_not("charm.started")
 def start_charm():
@@ -37,29 +42,46 @@ def start_charm():
 
     model = os.environ["JUJU_MODEL_NAME"]
 
-    run(
-        [
-            "openssl",
-            "req",
-            "-x509",
-            "-newkey",
-            "rsa:4096",
-            "-keyout",
-            "key.pem",
-            "-out",
-            "cert.pem",
-            "-days",
-            "365",
-            "-subj",
-            "/CN=localhost",
-            "-nodes",
-        ],
-        check=True,
-    )
+    cert, key = layer.istio_certs.get_certs("/CN=localhost")
 
-    layer.caas_base.pod_spec_set(
+    config = hookenv.config()
+    try:
+        mixer_resources = layer.istio_resources.container_resources(
+            config, "mixer", "heavy"
+        )
+        proxy_resources = layer.istio_resources.container_resources(
+            config, "proxy", "light"
+        )
+        # Juju runs charms with storage as a StatefulSet.
+        autoscaler = layer.istio_autoscaler.k8s_resources(
+            config,
+            "StatefulSet",
+            [
+                mixer_resources.get("requests", {}),
+                proxy_resources.get("requests", {}),
+            ],
+        )
+        load_shedding = layer.istio_mixer.load_shedding_args(config)
+        log_args = layer.istio_logging.istio_args(config)
+        proxy_log_args = layer.istio_logging.proxy_args(config)
+        tracing_args = layer.istio_zipkin.mixer_args(model, config)
+        store_url = layer.istio_config_source.mixer_store_url(
+            config, f"istio-galley.{model}.svc:9901"
+        )
+        service_account = layer.istio_config_source.service_account(
+            config, layer.istio_config_source.MIXER_RULES
+        )
+        mixer_env = layer.istio_mixer.environment(
+            config, mixer_resources.get("limits", {})
+        )
+    except ValueError as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
+
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
+            **service_account,
             "containers": [
                 {
                     "name": "mixer",
@@ -67,36 +89,37 @@ def start_charm():
                         "--monitoringPort=15014",
                         "--address",
                         "unix:///sock/mixer.socket",
-                        "--log_output_level=default:info",
-                        f"--configStoreURL=mcp://istio-galley.{model}.svc:9901",
+                        *log_args,
+                        f"--configStoreURL={store_url}",
                         "--certFile=/etc/certs/cert-chain.pem",
                         "--keyFile=/etc/certs/key.pem",
                         "--caCertFile=/etc/certs/root-cert.pem",
                         f"--configDefaultNamespace={model}",
                         "--useAdapterCRDs=false",
-                        "--trace_zipkin_url=http://zipkin:9411/api/v1/spans",
-                        "--averageLatencyThreshold",
-                        "100ms",
-                        "--loadsheddingMode",
-                        "enforce",
+                        *tracing_args,
+                        *load_shedding,
                     ],
                     "imageDetails": {
                         "imagePath": mixer_image.registry_path,
                         "username": mixer_image.username,
                         "password": mixer_image.password,
                     },
-                    "config": {"GODEBUG": "gctrace=1", "GOMAXPROCS": "6"},
+                    "kubernetes": {"resources": mixer_resources},
+                    "config": {
+                        **layer.istio_logging.environment(config),
+                        **mixer_env,
+                    },
                     "ports": [
-                        {"name": "port-1", "containerPort": 15014},
-                        {"name": "port-2", "containerPort": 42422},
+                        {"name": "monitoring", "containerPort": 15014},
+                        {"name": "prometheus", "containerPort": 42422},
                     ],
                     "files": [
                         {
                             "name": "istio-certs",
                             "mountPath": "/etc/certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         },
                         #  {
@@ -118,12 +141,15 @@ def start_charm():
                         "/etc/istio/proxy/envoy_telemetry.yaml.tmpl",
                         "--controlPlaneAuthPolicy",
                         "NONE",
+                        *log_args,
+                        *proxy_log_args,
                     ],
                     "imageDetails": {
                         "imagePath": proxy_image.registry_path,
                         "username": proxy_image.username,
                         "password": proxy_image.password,
                     },
+                    "kubernetes": {"resources": proxy_resources},
                     "config": {
                         "POD_NAME": {"field": {"path": "metadata.name", "api-version": "v1"}},
                         "POD_NAMESPACE": model,
@@ -131,10 +157,11 @@ def start_charm():
                             "field": {"path": "status.PodIP", "api-version": "v1"}
                         },
                         "SDS_ENABLED": False,
+                        **layer.istio_logging.environment(config),
                     },
                     "ports": [
-                        {"name": "port-3", "containerPort": 9091},
-                        {"name": "port-4", "containerPort": 15004},
+                        {"name": "grpc-mixer", "containerPort": 9091},
+                        {"name": "grpc-mixer-mtls", "containerPort": 15004},
                         #  {
                         #      "name": "http-envoy-prom",
                         #      "containerPort": 15090,
@@ -146,14 +173,15 @@ def start_charm():
                             "name": "istio-certs2",
                             "mountPath": "/etc/certs",
                             "files": {
-                                "cert-chain.pem": Path("cert.pem").read_text(),
-                                "key.pem": Path("key.pem").read_text(),
+                                "cert-chain.pem": cert,
+                                "key.pem": key,
                             },
                         }
                     ],
                 },
             ],
-        }
+        },
+        k8s_resources=autoscaler,
     )
 
     layer.status.maintenance("creating container")
@@ -1,8 +1,20 @@
+import json
 import os
+import re
 
+import yaml
+
+from charmhelpers.core import hookenv
 from charms import layer
 from charms.reactive import clear_flag, hook, set_flag, when, when_any, when_not
 
+DURATION = re.compile(r"^(\d+(\.\d+)?(ns|us|ms|s|m|h))+$")
+
+BADGER_DIR = "/badger"
+STRATEGIES_DIR = "/etc/jaeger/sampling"
+# The all-in-one image's own command line, which args replace.
+DEFAULT_STRATEGIES_FILE = "/etc/jaeger/sampling_strategies.json"
+
 
 @hook("upgrade-charm")
 def upgrade_charm():
@@ -14,11 +26,56 @@ def charm_ready():
     layer.status.active("")
 
 
+@when("istio-tracing.available")
+def configure_http(http):
+    http.configure(port=9411, hostname=hookenv.application_name())
+
+
 @when_any("layer.docker-resource.oci-image.changed")
 def update_image():
     clear_flag("charm.started")
 
 
+@when("config.changed")
+def config_changed():
+    clear_flag("charm.started")
+
+
+def storage_environment(config):
+    """Return the Jaeger span storage settings for the charm config."""
+    backend = config["storage-backend"]
+    if backend == "memory":
+        if config["max-traces"] < 1:
+            raise ValueError("max-traces must be positive")
+        return {
+            "SPAN_STORAGE_TYPE": "memory",
+            "MEMORY_MAX_TRACES": str(config["max-traces"]),
+        }
+    if backend != "badger":
+        raise ValueError(f"unknown storage-backend {backend!r}")
+    for key in ("span-ttl", "maintenance-interval"):
+        if not DURATION.match(config[key]):
+            raise ValueError(f"invalid duration for {key}: {config[key]!r}")
+    return {
+        "SPAN_STORAGE_TYPE": "badger",
+        "BADGER_EPHEMERAL": "false",
+        "BADGER_DIRECTORY_KEY": f"{BADGER_DIR}/key",
+        "BADGER_DIRECTORY_VALUE": f"{BADGER_DIR}/data",
+        "BADGER_SPAN_STORE_TTL": config["span-ttl"],
+        "BADGER_MAINTENANCE_INTERVAL": config["maintenance-interval"],
+    }
+
+
+def sampling_strategies(config):
+    """Return the sampling strategies file contents, or None if unset."""
+    strategies = yaml.safe_load(config["sampling-strategies"])
+    if strategies is None:
+        return None
+    if not isinstance(strategies, dict):
+        raise ValueError("sampling-strategies must be a mapping")
+    return json.dumps(strategies, indent=2)
+
+
 @when("layer.docker-resource.oci-image.available")
 @when_not("charm.started")
 def start_charm():
@@ -26,17 +83,43 @@ def start_charm():
 
     image_info = layer.docker_resource.get_info("oci-image")
 
-    layer.caas_base.pod_spec_set(
+    config = hookenv.config()
+    try:
+        resources = layer.istio_resources.container_resources(
+            config, "jaeger", "heavy"
+        )
+        log_level = layer.istio_logging.level(config)
+        storage_env = storage_environment(config)
+        strategies = sampling_strategies(config)
+    except (yaml.YAMLError, ValueError) as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
+
+    strategies_file = DEFAULT_STRATEGIES_FILE
+    files = []
+    if strategies:
+        strategies_file = f"{STRATEGIES_DIR}/strategies.json"
+        files.append(
+            {
+                "name": "sampling-strategies",
+                "mountPath": STRATEGIES_DIR,
+                "files": {"strategies.json": strategies},
+            }
+        )
+
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
             "containers": [
                 {
                     "name": "jaeger",
+                    "args": [f"--sampling.strategies-file={strategies_file}"],
                     "imageDetails": {
                         "imagePath": image_info.registry_path,
                         "username": image_info.username,
                         "password": image_info.password,
                     },
+                    "kubernetes": {"resources": resources},
                     "ports": [
                         {"name": "http", "containerPort": 9411},
                         {"name": "query-http", "containerPort": 16686},
@@ -59,9 +142,12 @@ def start_charm():
                     "config": {
                         "POD_NAMESPACE": os.environ["JUJU_MODEL_NAME"],
                         "COLLECTOR_ZIPKIN_HTTP_PORT": "9411",
-                        "MEMORY_MAX_TRACES": "50000",
                         "QUERY_BASE_PATH": "/jaeger",
+                        "LOG_LEVEL": log_level,
+                        **storage_env,
+                        **layer.istio_logging.environment(config),
                     },
+                    "files": files,
                 }
             ],
         }
@@ -1,9 +1,13 @@
 import os
 
 import yaml
+from charmhelpers.core import hookenv
 from charms import layer
 from charms.reactive import set_flag, clear_flag, when, when_not, hook, when_any
 
+# Kiali's -v verbosity for each log level.
+KIALI_VERBOSITY = {'debug': '4', 'info': '3', 'warn': '2', 'error': '1'}
+
 
 @hook("upgrade-charm")
 def upgrade_charm():
@@ -27,7 +31,17 @@ def start_charm():
 
     image_info = layer.docker_resource.get_info('oci-image')
 
-    layer.caas_base.pod_spec_set(
+    config = hookenv.config()
+    try:
+        resources = layer.istio_resources.container_resources(
+            config, 'kiali', 'light'
+        )
+        log_level = layer.istio_logging.level(config)
+    except ValueError as err:
+        layer.status.blocked(f'invalid configuration: {err}')
+        return
+
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
             'containers': [
@@ -38,17 +52,19 @@ def start_charm():
                         "-config",
                         "/kiali-configuration/config.yaml",
                         "-v",
-                        "4",
+                        KIALI_VERBOSITY[log_level],
                     ],
                     'imageDetails': {
                         'imagePath': image_info.registry_path,
                         'username': image_info.username,
                         'password': image_info.password,
                     },
+                    'kubernetes': {'resources': resources},
                     'config': {
                         'ACTIVE_NAMESPACE': os.environ['JUJU_MODEL_NAME'],
                         'PROMETHEUS_SERVICE_URL': 'http://prometheus:9090',
                         'SERVER_WEB_ROOT': '/kiali',
+                        **layer.istio_logging.environment(config),
                     },
                     'files': [
                         {
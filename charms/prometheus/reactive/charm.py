@@ -1,10 +1,74 @@
-from subprocess import run
+import os
 
 import yaml
+from charmhelpers.core import hookenv
 from charms import layer
-from charms.reactive import set_flag, clear_flag, when, when_not, hook, when_any
+from charms.reactive import (
+    set_flag,
+    clear_flag,
+    endpoint_from_name,
+    when,
+    when_not,
+    hook,
+    when_any,
+)
 from pathlib import Path
 
+# Scrape jobs for the Istio control plane. Maps job name to the relation
+# endpoint that enables it and the container port name serving its metrics.
+ISTIO_JOBS = {
+    'istio-mesh': ('istio-telemetry', 'prometheus'),
+    'istio-telemetry': ('istio-telemetry', 'monitoring'),
+    'istio-policy': ('istio-policy', 'monitoring'),
+    'pilot': ('istio-pilot', 'monitoring'),
+    'galley': ('istio-galley', 'monitoring'),
+    'citadel': ('istio-citadel', 'monitoring'),
+}
+
+# Series with high cardinality that none of the shipped dashboards use.
+HIGH_CARDINALITY_DROPS = {
+    'envoy-stats': [
+        {
+            'source_labels': ['__name__'],
+            'regex': (
+                'envoy_(listener|server|runtime|filesystem|cluster_manager'
+                '|http_mixer_filter)_.*'
+            ),
+            'action': 'drop',
+        },
+        {
+            'source_labels': ['__name__'],
+            'regex': (
+                'envoy_cluster_(circuit_breakers|outlier_detection|membership|lb'
+                '|upstream_(cx|rq)_(connect|destroy|close|length|rx|tx|overflow'
+                '|pending|retry|timeout|protocol|idle|none|max|http1|http2|total'
+                '|completed|xx|[0-9])).*'
+            ),
+            'action': 'drop',
+        },
+    ],
+    'kubernetes-cadvisor': [
+        {
+            'source_labels': ['__name__'],
+            'regex': (
+                'container_(cpu_load_average_10s|fs_(io_current|io_time_seconds_total'
+                '|io_time_weighted_seconds_total|reads_merged_total|sector_reads_total'
+                '|sector_writes_total|writes_merged_total|inodes_free|inodes_total)'
+                '|memory_(mapped_file|swap|failures_total|failcnt)|file_descriptors'
+                '|sockets|tasks_state|threads|threads_max|spec_.*'
+                '|network_(tcp|udp)_usage_total|last_seen|start_time_seconds)'
+            ),
+            'action': 'drop',
+        },
+    ],
+}
+
+RELATION_FLAGS = [
+    f'endpoint.{endpoint}.{event}'
+    for endpoint in sorted({endpoint for endpoint, _ in ISTIO_JOBS.values()})
+    for event in ('changed', 'departed')
+]
+
 
 @hook("upgrade-charm")
 def upgrade_charm():
@@ -21,62 +85,163 @@ def update_image():
     clear_flag('charm.started')
 
 
-@when('layer.docker-resource.oci-image.available')
+@when('config.changed')
+def config_changed():
+    clear_flag('charm.started')
+
+
+@when_any(*RELATION_FLAGS)
+def relations_changed():
+    for flag in RELATION_FLAGS:
+        clear_flag(flag)
+    clear_flag('charm.started')
+
+
+def istio_job(job_name, apps, port_name, namespace):
+    return {
+        'job_name': job_name,
+        'kubernetes_sd_configs': [
+            {'role': 'pod', 'namespaces': {'names': [namespace]}}
+        ],
+        'relabel_configs': [
+            {
+                'source_labels': [
+                    '__meta_kubernetes_pod_label_juju_app',
+                    '__meta_kubernetes_pod_container_port_name',
+                ],
+                'action': 'keep',
+                'regex': f"({'|'.join(apps)});{port_name}",
+            }
+        ],
+    }
+
+
+def job_settings(config):
+    settings = yaml.safe_load(config['job-settings']) or {}
+    if not isinstance(settings, dict) or not all(
+        isinstance(value, dict) for value in settings.values()
+    ):
+        raise ValueError('expected a mapping of job names to settings')
+    return settings
+
+
+def build_config(namespace, config):
+    """Render prometheus.yml from the base jobs, relations and charm config."""
+    prometheus_config = layer.istio_files.load_yaml('files/prometheus.yml')
+    prometheus_config['global'] = {
+        'scrape_interval': config['scrape-interval'],
+        'scrape_timeout': config['scrape-timeout'],
+        'evaluation_interval': config['evaluation-interval'],
+    }
+
+    jobs = []
+    for job_name, (endpoint, port_name) in ISTIO_JOBS.items():
+        services = endpoint_from_name(endpoint).services()
+        apps = sorted(service['service_name'] for service in services)
+        if apps:
+            jobs.append(istio_job(job_name, apps, port_name, namespace))
+    jobs.extend(prometheus_config['scrape_configs'])
+
+    disabled = set(config['disabled-jobs'].split())
+    settings = job_settings(config)
+
+    for job in jobs:
+        drops = HIGH_CARDINALITY_DROPS.get(job['job_name'])
+        if drops and config['drop-high-cardinality-metrics']:
+            job.setdefault('metric_relabel_configs', []).extend(drops)
+        if config['sample-limit']:
+            job['sample_limit'] = config['sample-limit']
+        job.update(settings.get(job['job_name'], {}))
+
+    prometheus_config['scrape_configs'] = [
+        job for job in jobs if job['job_name'] not in disabled
+    ]
+    return prometheus_config
+
+
+def storage_args(config):
+    """Return the TSDB and query engine flags for the charm config."""
+    args = [
+        '--storage.tsdb.path=/prometheus',
+        f"--storage.tsdb.retention.time={config['retention-time']}",
+        f"--query.max-concurrency={config['query-max-concurrency']}",
+        f"--query.max-samples={config['query-max-samples']}",
+        f"--query.timeout={config['query-timeout']}",
+    ]
+    if config['retention-size']:
+        args.append(f"--storage.tsdb.retention.size={config['retention-size']}")
+    if config['wal-compression']:
+        args.append('--storage.tsdb.wal-compression')
+    if config['min-block-duration']:
+        args.append(f"--storage.tsdb.min-block-duration={config['min-block-duration']}")
+    if config['max-block-duration']:
+        args.append(f"--storage.tsdb.max-block-duration={config['max-block-duration']}")
+    return args
+
+
+@when('layer.docker-resource.oci-image.available', 'istio-certs.available')
 @when_not('charm.started')
 def start_charm():
     layer.status.maintenance('configuring container')
 
     image_info = layer.docker_resource.get_info('oci-image')
 
-    run(
-        [
-            "openssl",
-            "req",
-            "-x509",
-            "-newkey",
-            "rsa:4096",
-            "-keyout",
-            "key.pem",
-            "-out",
-            "cert.pem",
-            "-days",
-            "365",
-            "-subj",
-            "/CN=localhost",
-            "-nodes",
-        ],
-        check=True,
-    )
+    namespace = os.environ['JUJU_MODEL_NAME']
+
+    config = hookenv.config()
+
+    try:
+        prometheus_config = build_config(namespace, config)
+    except (yaml.YAMLError, ValueError) as err:
+        layer.status.blocked(f'invalid job-settings: {err}')
+        return
 
-    layer.caas_base.pod_spec_set(
+    try:
+        resources = layer.istio_resources.container_resources(
+            config, 'prometheus', 'heavy'
+        )
+        log_level = layer.istio_logging.level(config)
+    except ValueError as err:
+        layer.status.blocked(f'invalid configuration: {err}')
+        return
+
+    cert, key = layer.istio_certs.get_certs('/CN=localhost')
+
+    layer.istio_pod_spec.pod_spec_set(
         {
             "version": 2,
             'containers': [
                 {
                     'name': 'prometheus',
                     'args': [
-                        '--storage.tsdb.retention=6h',
                         '--config.file=/etc/prometheus/prometheus.yml',
+                        *storage_args(config),
+                        f'--log.level={log_level}',
                     ],
                     'imageDetails': {
                         'imagePath': image_info.registry_path,
                         'username': image_info.username,
                         'password': image_info.password,
                     },
+                    'kubernetes': {'resources': resources},
+                    'config': layer.istio_logging.environment(config),
                     'ports': [{'name': 'http', 'containerPort': 9090}],
                     'files': [
                         {
                             'name': 'prometheus',
                             'mountPath': '/etc/prometheus',
-                            'files': {'prometheus.yml': Path('files/prometheus.yml').read_text()},
+                            'files': {
+                                'prometheus.yml': layer.istio_files.dump_yaml(prometheus_config),
+                                'recording-rules.yml': Path('files/recording-rules.yml').read_text(),
+                            },
                         },
                         {
                             'name': 'istio-certs',
                             'mountPath': '/etc/istio-certs',
                             'files': {
-                                'root-cert.pem': Path('cert.pem').read_text(),
-                                'cert-chain.pem': Path('cert.pem').read_text(),
-                                'key.pem': Path('key.pem').read_text(),
+                                'root-cert.pem': cert,
+                                'cert-chain.pem': cert,
+                                'key.pem': key,
                             },
                         },
                     ],
@@ -0,0 +1,41 @@
+from charmhelpers.core import hookenv
+
+
+def horizontal_pod_autoscaler(config, kind, requests):
+    """Return a HorizontalPodAutoscaler for the application's workload.
+
+    ``kind`` is the kind of workload Juju creates for the application,
+    ``Deployment``, or ``StatefulSet`` for charms with storage. ``requests``
+    are the resource requests of the pod's containers, which CPU
+    utilization is measured against. Raises ValueError on invalid config.
+    """
+    if not 1 <= config["min-replicas"] <= config["max-replicas"]:
+        raise ValueError("replicas must satisfy 1 <= min-replicas <= max-replicas")
+    if not 1 <= config["target-cpu-utilization"] <= 100:
+        raise ValueError("target-cpu-utilization must be between 1 and 100")
+    if not all(request.get("cpu") for request in requests):
+        raise ValueError("autoscaling needs a CPU request on every container")
+
+    name = hookenv.application_name()
+    return {
+        "name": name,
+        "spec": {
+            "scaleTargetRef": {"apiVersion": "apps/v1", "kind": kind, "name": name},
+            "minReplicas": config["min-replicas"],
+            "maxReplicas": config["max-replicas"],
+            "targetCPUUtilizationPercentage": config["target-cpu-utilization"],
+        },
+    }
+
+
+def k8s_resources(config, kind, requests):
+    """Return the ``k8s_resources`` for ``pod_spec_set``, or None."""
+    if not config["autoscaling"]:
+        return None
+    return {
+        "kubernetesResources": {
+            "horizontalPodAutoscalers": [
+                horizontal_pod_autoscaler(config, kind, requests)
+            ]
+        }
+    }
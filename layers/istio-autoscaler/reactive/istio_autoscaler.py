@@ -0,0 +1,11 @@
+from charms.reactive import clear_flag, when_any
+
+
+@when_any(
+    "config.changed.autoscaling",
+    "config.changed.min-replicas",
+    "config.changed.max-replicas",
+    "config.changed.target-cpu-utilization",
+)
+def autoscaler_config_changed():
+    clear_flag("charm.started")
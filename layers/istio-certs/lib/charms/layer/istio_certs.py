@@ -0,0 +1,119 @@
+import json
+import time
+from pathlib import Path
+from subprocess import run
+from tempfile import TemporaryDirectory
+
+from charmhelpers.core import hookenv
+
+LEADER_KEY = "istio-certs"
+
+KEY_ARGS = {
+    "rsa": ["-newkey", "rsa:4096"],
+    "ecdsa": ["-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"],
+}
+
+
+def _settings():
+    config = hookenv.config()
+    key_type = config.get("cert-key-type", "rsa")
+    if key_type not in KEY_ARGS:
+        raise ValueError(f"Unknown cert-key-type: {key_type}")
+    days = int(config.get("cert-validity-days", 365))
+    renew_days = int(config.get("cert-renew-days", 30))
+    # A renewal window as long as the validity would regenerate the
+    # certificate, and restart every pod, on each hook.
+    if not 0 <= renew_days < days:
+        raise ValueError("cert-renew-days must be less than cert-validity-days")
+    return key_type, days, renew_days
+
+
+def _generate(subject, key_type, days):
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        run(
+            [
+                "openssl",
+                "req",
+                "-x509",
+                *KEY_ARGS[key_type],
+                "-keyout",
+                str(tmp / "key.pem"),
+                "-out",
+                str(tmp / "cert.pem"),
+                "-days",
+                str(days),
+                "-subj",
+                subject,
+                "-nodes",
+            ],
+            check=True,
+        )
+        return (tmp / "cert.pem").read_text(), (tmp / "key.pem").read_text()
+
+
+def _is_current(stored, subject, key_type, renew_days):
+    if not stored:
+        return False
+    if stored["subject"] != subject or stored["key-type"] != key_type:
+        return False
+    return time.time() < stored["expires"] - renew_days * 86400
+
+
+def _load():
+    stored = hookenv.leader_get(LEADER_KEY)
+    return json.loads(stored) if stored else None
+
+
+def validate():
+    """Raise ValueError if the certificate options are invalid."""
+    _settings()
+
+
+def available():
+    """Return True if this unit can hand out a certificate.
+
+    The leader can always generate one; other units wait until the leader
+    has published it.
+    """
+    return hookenv.is_leader() or _load() is not None
+
+
+def needs_renewal():
+    """Return True if the leader's certificate is missing or close to expiry."""
+    if not hookenv.is_leader():
+        return False
+    stored = _load()
+    if not stored:
+        return True
+    key_type, _, renew_days = _settings()
+    return not _is_current(stored, stored["subject"], key_type, renew_days)
+
+
+def get_certs(subject):
+    """Return a ``(cert, key)`` PEM pair for ``subject``.
+
+    The leader generates the pair on first use and publishes it through
+    leader settings. Every unit, the leader included, then hands out that
+    same pair, so all units render identical pod specs and pods are not
+    restarted just because a hook ran again.
+    """
+    stored = _load()
+
+    if hookenv.is_leader():
+        key_type, days, renew_days = _settings()
+        if not _is_current(stored, subject, key_type, renew_days):
+            hookenv.log(f"Generating new {key_type} certificate for {subject}")
+            cert, key = _generate(subject, key_type, days)
+            stored = {
+                "subject": subject,
+                "key-type": key_type,
+                "expires": time.time() + days * 86400,
+                "cert": cert,
+                "key": key,
+            }
+            hookenv.leader_set({LEADER_KEY: json.dumps(stored)})
+    elif not stored:
+        raise RuntimeError("the leader has not published a certificate yet")
+
+    return stored["cert"], stored["key"]
@@ -0,0 +1,45 @@
+from charms import layer
+from charms.reactive import clear_flag, hook, set_flag, when_any, when_not
+
+
+@hook("update-status")
+def rotate_certs():
+    try:
+        renew = layer.istio_certs.needs_renewal()
+    except ValueError:
+        # Invalid options are reported by check_certs.
+        return
+    if renew:
+        clear_flag("charm.started")
+
+
+@hook("leader-elected", "leader-settings-changed")
+def leader_changed():
+    # A new leader may have to regenerate the certificate, and followers
+    # have to pick up whatever the leader published.
+    clear_flag("istio-certs.available")
+    clear_flag("charm.started")
+
+
+@when_not("istio-certs.available")
+def check_certs():
+    try:
+        layer.istio_certs.validate()
+    except ValueError as err:
+        layer.status.blocked(f"invalid configuration: {err}")
+        return
+    if layer.istio_certs.available():
+        set_flag("istio-certs.available")
+    else:
+        layer.status.waiting("waiting for the leader to publish certificates")
+
+
+@when_any(
+    "config.changed.cert-key-type",
+    "config.changed.cert-validity-days",
+    "config.changed.cert-renew-days",
+)
+def cert_config_changed():
+    # Revalidated by check_certs before any charm hands out certificates.
+    clear_flag("istio-certs.available")
+    clear_flag("charm.started")
@@ -0,0 +1,98 @@
+CONFIG_SOURCES = ("galley", "kubernetes")
+
+ISTIO_GROUPS = [
+    "config.istio.io",
+    "networking.istio.io",
+    "authentication.istio.io",
+    "rbac.istio.io",
+]
+
+# What pilot and the mixers watch when reading config from Kubernetes,
+# after the cluster roles of the upstream Istio charts.
+PILOT_RULES = [
+    {"apiGroups": ISTIO_GROUPS, "resources": ["*"], "verbs": ["get", "list", "watch"]},
+    {
+        "apiGroups": ["apiextensions.k8s.io"],
+        "resources": ["customresourcedefinitions"],
+        "verbs": ["get", "list", "watch"],
+    },
+    {
+        "apiGroups": ["extensions"],
+        "resources": ["ingresses"],
+        "verbs": ["get", "list", "watch"],
+    },
+    {
+        "apiGroups": [""],
+        "resources": [
+            "configmaps",
+            "endpoints",
+            "namespaces",
+            "nodes",
+            "pods",
+            "secrets",
+            "services",
+        ],
+        "verbs": ["get", "list", "watch"],
+    },
+]
+
+MIXER_RULES = [
+    {
+        "apiGroups": ["config.istio.io", "rbac.istio.io"],
+        "resources": ["*"],
+        "verbs": ["get", "list", "watch"],
+    },
+    {
+        "apiGroups": ["apiextensions.k8s.io"],
+        "resources": ["customresourcedefinitions"],
+        "verbs": ["get", "list", "watch"],
+    },
+    {
+        "apiGroups": [""],
+        "resources": [
+            "configmaps",
+            "endpoints",
+            "namespaces",
+            "pods",
+            "replicationcontrollers",
+            "secrets",
+            "services",
+        ],
+        "verbs": ["get", "list", "watch"],
+    },
+    {
+        "apiGroups": ["apps", "extensions"],
+        "resources": ["replicasets"],
+        "verbs": ["get", "list", "watch"],
+    },
+]
+
+
+def from_galley(config):
+    """Return True if config is read from istio-galley, False if from Kubernetes."""
+    source = config["config-source"]
+    if source not in CONFIG_SOURCES:
+        raise ValueError(f"unknown config-source {source!r}")
+    return source == "galley"
+
+
+def mesh_sources(config, galley):
+    """Return the mesh config's ``configSources`` for the ``host:port`` galley.
+
+    Pilot watches Kubernetes itself when there are none.
+    """
+    return [{"address": galley}] if from_galley(config) else []
+
+
+def mixer_store_url(config, galley):
+    return f"mcp://{galley}" if from_galley(config) else "k8s://"
+
+
+def service_account(config, rules):
+    """Return the pod spec's service account for watching Istio config.
+
+    Empty when reading config from galley, to be merged into the pod spec.
+    """
+    if from_galley(config):
+        return {}
+    return {"serviceAccount": {"global": True, "rules": rules}}
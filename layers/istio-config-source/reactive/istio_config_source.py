@@ -0,0 +1,6 @@
+from charms.reactive import clear_flag, when
+
+
+@when("config.changed.config-source")
+def config_source_changed():
+    clear_flag("charm.started")
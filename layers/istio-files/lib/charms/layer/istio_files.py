@@ -0,0 +1,68 @@
+import json
+from hashlib import sha256
+from pathlib import Path
+
+import yaml
+
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+from charmhelpers.core import hookenv
+
+COMPILED_DIR = "compiled"
+
+
+def artifact_path(path):
+    """Return the path of the precompiled artifact for ``path``."""
+    path = Path(path)
+    return path.parent / COMPILED_DIR / f"{path.name}.json"
+
+
+def compile_yaml(path):
+    """Parse ``path`` and write its precompiled artifact. Returns the documents."""
+    path = Path(path)
+    source = path.read_bytes()
+    documents = [doc for doc in yaml.load_all(source, Loader=SafeLoader) if doc]
+    artifact = artifact_path(path)
+    artifact.parent.mkdir(exist_ok=True)
+    artifact.write_text(
+        json.dumps(
+            {"sha256": sha256(source).hexdigest(), "documents": documents},
+            separators=(",", ":"),
+        )
+    )
+    return documents
+
+
+def load_yaml_all(path):
+    """Return the list of non-empty YAML documents in ``path``."""
+    path = Path(path)
+    artifact = artifact_path(path)
+    if artifact.exists():
+        compiled = json.loads(artifact.read_text())
+        if compiled["sha256"] == sha256(path.read_bytes()).hexdigest():
+            return compiled["documents"]
+        hookenv.log(f"Precompiled {artifact} is stale, reparsing {path}")
+
+    try:
+        return compile_yaml(path)
+    except OSError:
+        # Read-only charm directory; parse without caching.
+        documents = yaml.load_all(path.read_bytes(), Loader=SafeLoader)
+        return [doc for doc in documents if doc]
+
+
+def load_yaml(path):
+    """Return the single YAML document in ``path``."""
+    documents = load_yaml_all(path)
+    return documents[0] if documents else None
+
+
+def load_json(path):
+    return json.loads(Path(path).read_text())
+
+
+def dump_yaml(data):
+    return yaml.dump(data, Dumper=SafeDumper)
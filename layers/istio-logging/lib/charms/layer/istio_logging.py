@@ -0,0 +1,30 @@
+LEVELS = ("debug", "info", "warn", "error")
+
+# Envoy is quieter than the Istio components at the same level: its info
+# logs are per connection, so "info" maps to Envoy's own default.
+ENVOY_LEVELS = {
+    "debug": "debug",
+    "info": "warning",
+    "warn": "warning",
+    "error": "error",
+}
+
+
+def level(config):
+    """Return the configured log level. Raises ValueError if invalid."""
+    if config["log-level"] not in LEVELS:
+        raise ValueError(f"unknown log-level {config['log-level']!r}")
+    return config["log-level"]
+
+
+def istio_args(config):
+    # Every scope, so that debug covers all of a component's logs.
+    return [f"--log_output_level=all:{level(config)}"]
+
+
+def proxy_args(config):
+    return ["--proxyLogLevel", ENVOY_LEVELS[level(config)]]
+
+
+def environment(config):
+    return {"GODEBUG": "gctrace=1"} if config["debug-gc"] else {}
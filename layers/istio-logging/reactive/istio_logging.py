@@ -0,0 +1,6 @@
+from charms.reactive import clear_flag, when_any
+
+
+@when_any("config.changed.log-level", "config.changed.debug-gc")
+def logging_config_changed():
+    clear_flag("charm.started")
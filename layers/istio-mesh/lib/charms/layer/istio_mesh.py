@@ -0,0 +1,237 @@
+import re
+
+import yaml
+
+from charms import layer
+from charms.reactive import is_flag_set
+
+POLICY_CHECKS = ("auto", "enabled", "disabled")
+
+DURATION = re.compile(r"^(\d+(\.\d+)?(ns|us|ms|s|m|h))+$")
+DURATION_OPTIONS = (
+    "report-batch-max-time",
+    "dns-refresh-rate",
+    "connect-timeout",
+    "protocol-detection-timeout",
+    "drain-duration",
+)
+
+
+def policy_checks_enabled(config):
+    mode = config["policy-checks"]
+    if mode not in POLICY_CHECKS:
+        raise ValueError(f"unknown policy-checks mode {mode!r}")
+    if mode == "auto":
+        return is_flag_set("endpoint.istio-policy.joined")
+    return mode == "enabled"
+
+
+def mixer_settings(config):
+    """Return the mixer policy and report batching part of the mesh config."""
+    if config["report-batch-max-entries"] < 1:
+        raise ValueError("report-batch-max-entries must be positive")
+    return {
+        "disablePolicyChecks": not policy_checks_enabled(config),
+        "policyCheckFailOpen": config["policy-check-fail-open"],
+        "reportBatchMaxEntries": config["report-batch-max-entries"],
+        "reportBatchMaxTime": config["report-batch-max-time"],
+    }
+
+
+OUTBOUND_TRAFFIC_POLICIES = ("ALLOW_ANY", "REGISTRY_ONLY")
+
+ACCESS_LOG_MODES = ("all", "gateways", "off")
+ACCESS_LOG_ENCODINGS = ("TEXT", "JSON")
+ACCESS_LOG_PATH = "/dev/stdout"
+
+# Fields of Istio's default text access log format, for JSON logs written
+# through the EnvoyFilter below. The mesh config has its own JSON format.
+ACCESS_LOG_JSON_FORMAT = {
+    "start_time": "%START_TIME%",
+    "method": "%REQ(:METHOD)%",
+    "path": "%REQ(X-ENVOY-ORIGINAL-PATH?:PATH)%",
+    "protocol": "%PROTOCOL%",
+    "response_code": "%RESPONSE_CODE%",
+    "response_flags": "%RESPONSE_FLAGS%",
+    "bytes_received": "%BYTES_RECEIVED%",
+    "bytes_sent": "%BYTES_SENT%",
+    "duration": "%DURATION%",
+    "upstream_service_time": "%RESP(X-ENVOY-UPSTREAM-SERVICE-TIME)%",
+    "x_forwarded_for": "%REQ(X-FORWARDED-FOR)%",
+    "user_agent": "%REQ(USER-AGENT)%",
+    "request_id": "%REQ(X-REQUEST-ID)%",
+    "authority": "%REQ(:AUTHORITY)%",
+    "upstream_host": "%UPSTREAM_HOST%",
+    "upstream_cluster": "%UPSTREAM_CLUSTER%",
+    "downstream_remote_address": "%DOWNSTREAM_REMOTE_ADDRESS%",
+}
+
+HTTP_CONNECTION_MANAGER = (
+    "type.googleapis.com/"
+    "envoy.config.filter.network.http_connection_manager.v2.HttpConnectionManager"
+)
+FILE_ACCESS_LOG = "type.googleapis.com/envoy.config.accesslog.v2.FileAccessLog"
+
+
+def _access_log_filter(config):
+    """Return the Envoy access log filter for the filter options, or None."""
+    filters = []
+    if config["access-log-min-status"]:
+        filters.append(
+            {
+                "status_code_filter": {
+                    "comparison": {
+                        "op": "GE",
+                        "value": {
+                            "default_value": config["access-log-min-status"],
+                            "runtime_key": "access_log.min_status",
+                        },
+                    }
+                }
+            }
+        )
+    flags = [f.strip() for f in config["access-log-response-flags"].split(",")]
+    if any(flags):
+        filters.append({"response_flag_filter": {"flags": [f for f in flags if f]}})
+    if len(filters) > 1:
+        return {"or_filter": {"filters": filters}}
+    return filters[0] if filters else None
+
+
+def _through_envoy_filter(config):
+    # The mesh config can only log every request of every proxy. Anything
+    # narrower is configured on the proxies' HTTP connection managers.
+    return config["access-log"] == "gateways" or (
+        config["access-log"] == "all" and _access_log_filter(config) is not None
+    )
+
+
+def access_log_settings(config):
+    """Return the access log part of the mesh config."""
+    if config["access-log"] not in ACCESS_LOG_MODES:
+        raise ValueError(f"unknown access-log mode {config['access-log']!r}")
+    if config["access-log-encoding"] not in ACCESS_LOG_ENCODINGS:
+        raise ValueError(
+            f"unknown access-log-encoding {config['access-log-encoding']!r}"
+        )
+    enabled = config["access-log"] == "all" and not _through_envoy_filter(config)
+    return {
+        "accessLogFile": ACCESS_LOG_PATH if enabled else "",
+        "accessLogFormat": "",
+        "accessLogEncoding": config["access-log-encoding"],
+    }
+
+
+def access_log_envoy_filter(config):
+    """Return an EnvoyFilter that writes the configured access logs, or None.
+
+    Needed when only gateways log, or when logs are filtered by status code
+    or response flags, neither of which the mesh config supports.
+    """
+    access_log_settings(config)
+    if config["access-log"] == "off" or not _through_envoy_filter(config):
+        return None
+
+    log_config = {"@type": FILE_ACCESS_LOG, "path": ACCESS_LOG_PATH}
+    if config["access-log-encoding"] == "JSON":
+        log_config["json_format"] = ACCESS_LOG_JSON_FORMAT
+    access_log = {"name": "envoy.file_access_log", "typed_config": log_config}
+    log_filter = _access_log_filter(config)
+    if log_filter:
+        access_log["filter"] = log_filter
+
+    context = "GATEWAY" if config["access-log"] == "gateways" else "ANY"
+    return {
+        "apiVersion": "networking.istio.io/v1alpha3",
+        "kind": "EnvoyFilter",
+        "metadata": {"name": "access-log"},
+        "spec": {
+            "configPatches": [
+                {
+                    "applyTo": "NETWORK_FILTER",
+                    "match": {
+                        "context": context,
+                        "listener": {
+                            "filterChain": {
+                                "filter": {"name": "envoy.http_connection_manager"}
+                            }
+                        },
+                    },
+                    "patch": {
+                        "operation": "MERGE",
+                        "value": {
+                            "typed_config": {
+                                "@type": HTTP_CONNECTION_MANAGER,
+                                "access_log": [access_log],
+                            }
+                        },
+                    },
+                }
+            ]
+        },
+    }
+
+
+def _validate(config):
+    for key in DURATION_OPTIONS:
+        if not DURATION.match(config[key]):
+            raise ValueError(f"invalid duration for {key}: {config[key]!r}")
+    if config["proxy-concurrency"] < 0:
+        raise ValueError("proxy-concurrency must not be negative")
+    if config["outbound-traffic-policy"] not in OUTBOUND_TRAFFIC_POLICIES:
+        raise ValueError(
+            f"unknown outbound-traffic-policy {config['outbound-traffic-policy']!r}"
+        )
+
+
+def build(namespace, config, galley=None, pilot=None):
+    """Return the mesh config shared by every control plane component.
+
+    ``galley`` and ``pilot`` are ``host:port`` addresses and default to the
+    services of the same name in ``namespace``. Raises ValueError on
+    invalid config.
+    """
+    _validate(config)
+    galley = galley or f"istio-galley.{namespace}.svc:9901"
+    pilot = pilot or f"istio-pilot.{namespace}:15010"
+    zipkin = layer.istio_zipkin.address(namespace, config)
+    proxy = {
+        "connectTimeout": config["connect-timeout"],
+        "configPath": "/etc/istio/proxy",
+        "binaryPath": "/usr/local/bin/envoy",
+        "serviceCluster": "istio-proxy",
+        "drainDuration": config["drain-duration"],
+        "parentShutdownDuration": "1m0s",
+        "proxyAdminPort": 15000,
+        "concurrency": config["proxy-concurrency"],
+        "controlPlaneAuthPolicy": "NONE",
+        "discoveryAddress": pilot,
+    }
+    if zipkin:
+        proxy["tracing"] = {"zipkin": {"address": zipkin}}
+    return {
+        **mixer_settings(config),
+        **access_log_settings(config),
+        "enableTracing": zipkin is not None,
+        "enableEnvoyAccessLogService": False,
+        "mixerCheckServer": f"istio-policy.{namespace}.svc.cluster.local:9091",
+        "mixerReportServer": f"istio-telemetry.{namespace}.svc.cluster.local:9091",
+        "ingressService": "istio-ingressgateway",
+        "connectTimeout": config["connect-timeout"],
+        "protocolDetectionTimeout": config["protocol-detection-timeout"],
+        "dnsRefreshRate": config["dns-refresh-rate"],
+        "sdsUdsPath": "",
+        "enableSdsTokenMount": False,
+        "sdsUseK8sSaJwt": False,
+        "trustDomain": "",
+        "outboundTrafficPolicy": {"mode": config["outbound-traffic-policy"]},
+        "localityLbSetting": {"enabled": True},
+        "rootNamespace": namespace,
+        "configSources": layer.istio_config_source.mesh_sources(config, galley),
+        "defaultConfig": proxy,
+    }
+
+
+def dump(mesh):
+    return yaml.dump(mesh)
+
@@ -0,0 +1,35 @@
+from charms.reactive import clear_flag, set_flag, when, when_any, when_not
+
+
+@when_any(
+    "config.changed.policy-checks",
+    "config.changed.policy-check-fail-open",
+    "config.changed.report-batch-max-entries",
+    "config.changed.report-batch-max-time",
+    "config.changed.dns-refresh-rate",
+    "config.changed.connect-timeout",
+    "config.changed.protocol-detection-timeout",
+    "config.changed.drain-duration",
+    "config.changed.proxy-concurrency",
+    "config.changed.outbound-traffic-policy",
+    "config.changed.access-log",
+    "config.changed.access-log-encoding",
+    "config.changed.access-log-min-status",
+    "config.changed.access-log-response-flags",
+)
+def mesh_config_changed():
+    clear_flag("charm.started")
+
+
+@when("endpoint.istio-policy.joined")
+@when_not("istio-mesh.policy-related")
+def policy_related():
+    set_flag("istio-mesh.policy-related")
+    clear_flag("charm.started")
+
+
+@when("istio-mesh.policy-related")
+@when_not("endpoint.istio-policy.joined")
+def policy_unrelated():
+    clear_flag("istio-mesh.policy-related")
+    clear_flag("charm.started")
@@ -0,0 +1,51 @@
+from charms import layer
+
+LOAD_SHEDDING_MODES = ("disabled", "logonly", "enforce")
+
+# Bytes of memory limit per GOMAXPROCS.
+MEMORY_PER_PROC = 512 * 1024 ** 2
+
+
+def gomaxprocs(config, limits):
+    """Return GOMAXPROCS for mixer, or None to leave it to the Go runtime.
+
+    ``limits`` are the mixer container's resource limits.
+    """
+    if config["gomaxprocs"] < 0:
+        raise ValueError("gomaxprocs must not be negative")
+    if config["gomaxprocs"]:
+        return config["gomaxprocs"]
+    if not limits.get("cpu"):
+        return None
+    procs = layer.istio_resources.cpu_count(limits["cpu"])
+    if limits.get("memory"):
+        memory = layer.istio_resources.parse_quantity(limits["memory"])
+        procs = min(procs, max(1, int(memory // MEMORY_PER_PROC)))
+    return procs
+
+
+def environment(config, limits):
+    env = {}
+    procs = gomaxprocs(config, limits)
+    if procs:
+        env["GOMAXPROCS"] = str(procs)
+    return env
+
+
+def load_shedding_args(config):
+    mode = config["load-shedding-mode"]
+    if mode not in LOAD_SHEDDING_MODES:
+        raise ValueError(f"unknown load-shedding-mode {mode!r}")
+    for option in ("load-shedding-max-rps", "load-shedding-burst-size"):
+        if config[option] < 0:
+            raise ValueError(f"{option} must not be negative")
+    args = ["--loadsheddingMode", mode]
+    if mode == "disabled":
+        return args
+    if config["load-shedding-latency-threshold"]:
+        args += ["--averageLatencyThreshold", config["load-shedding-latency-threshold"]]
+    if config["load-shedding-max-rps"]:
+        args += ["--maxRequestsPerSecond", str(config["load-shedding-max-rps"])]
+    if config["load-shedding-burst-size"]:
+        args += ["--burstSize", str(config["load-shedding-burst-size"])]
+    return args
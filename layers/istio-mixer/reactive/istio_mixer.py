@@ -0,0 +1,12 @@
+from charms.reactive import clear_flag, when_any
+
+
+@when_any(
+    "config.changed.gomaxprocs",
+    "config.changed.load-shedding-mode",
+    "config.changed.load-shedding-latency-threshold",
+    "config.changed.load-shedding-max-rps",
+    "config.changed.load-shedding-burst-size",
+)
+def mixer_config_changed():
+    clear_flag("charm.started")
@@ -0,0 +1,62 @@
+import json
+from hashlib import sha256
+
+from charmhelpers.core import hookenv, unitdata
+from charms import layer
+
+KV_KEY = "istio-pod-spec.applied"
+
+
+def _digest(value):
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _hashes(spec, k8s_resources):
+    return {
+        "spec": _digest(spec),
+        "k8s_resources": _digest(k8s_resources),
+        "containers": {
+            container["name"]: _digest(container)
+            for container in spec.get("containers", [])
+        },
+    }
+
+
+def changed_containers(old, new):
+    """Return the sorted names of containers that differ between two hash sets."""
+    old = old.get("containers", {})
+    new = new.get("containers", {})
+    return sorted(
+        name for name in set(old) | set(new) if old.get(name) != new.get(name)
+    )
+
+
+def pod_spec_set(spec, k8s_resources=None):
+    """Apply ``spec`` unless it is identical to the last applied pod spec.
+
+    Returns True if ``pod-spec-set`` was called, False if it was skipped.
+    """
+    kv = unitdata.kv()
+    applied = kv.get(KV_KEY) or {}
+    hashes = _hashes(spec, k8s_resources)
+
+    if (
+        applied.get("spec") == hashes["spec"]
+        and applied.get("k8s_resources") == hashes["k8s_resources"]
+    ):
+        hookenv.log("Pod spec unchanged, skipping pod-spec-set")
+        return False
+
+    containers = changed_containers(applied, hashes)
+    if containers:
+        hookenv.log(f"Pod spec changed for containers: {', '.join(containers)}")
+    if applied.get("k8s_resources") != hashes["k8s_resources"]:
+        hookenv.log("Kubernetes resources changed")
+
+    if k8s_resources is None:
+        layer.caas_base.pod_spec_set(spec)
+    else:
+        layer.caas_base.pod_spec_set(spec, k8s_resources=k8s_resources)
+    kv.set(KV_KEY, hashes)
+    return True
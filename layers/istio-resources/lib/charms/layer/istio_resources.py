@@ -0,0 +1,107 @@
+import math
+import re
+
+import yaml
+
+QUANTITY = re.compile(r"^(\d+(?:\.\d+)?)([a-zA-Z]*)$")
+SUFFIXES = {
+    "": 1,
+    "m": 0.001,
+    "k": 1000,
+    "M": 1000 ** 2,
+    "G": 1000 ** 3,
+    "T": 1000 ** 4,
+    "Ki": 1024,
+    "Mi": 1024 ** 2,
+    "Gi": 1024 ** 3,
+    "Ti": 1024 ** 4,
+}
+
+
+def parse_quantity(value):
+    """Parse a Kubernetes resource quantity such as ``1500m`` or ``2Gi``."""
+    match = QUANTITY.match(str(value).strip())
+    if not match or match[2] not in SUFFIXES:
+        raise ValueError(f"invalid quantity {value!r}")
+    return float(match[1]) * SUFFIXES[match[2]]
+
+
+def cpu_count(quantity):
+    """Return the number of whole cores a CPU quantity can keep busy."""
+    return max(1, math.ceil(parse_quantity(quantity)))
+
+
+def concurrency_args(concurrency, limits):
+    """Return Envoy's --concurrency arguments for a proxy container.
+
+    ``concurrency`` is the configured number of worker threads, 0 to size
+    them from the CPU limit in ``limits``, the container's resource limits.
+    """
+    if concurrency < 0:
+        raise ValueError("concurrency must not be negative")
+    if not concurrency and limits.get("cpu"):
+        concurrency = cpu_count(limits["cpu"])
+    return ["--concurrency", str(concurrency)] if concurrency else []
+
+
+def _resources(cpu_request, memory_request, cpu_limit, memory_limit):
+    return {
+        "requests": {"cpu": cpu_request, "memory": memory_request},
+        "limits": {"cpu": cpu_limit, "memory": memory_limit},
+    }
+
+
+# Requests and limits per profile and container size. Light containers are
+# proxies and small helpers, heavy ones do the bulk of the work: pilot
+# discovery, mixer, and prometheus and jaeger, which keep data in memory.
+PROFILES = {
+    "none": {},
+    "small": {
+        "light": _resources("10m", "32Mi", "500m", "128Mi"),
+        "standard": _resources("50m", "64Mi", "1", "256Mi"),
+        "heavy": _resources("100m", "256Mi", "1", "1Gi"),
+    },
+    "medium": {
+        "light": _resources("50m", "64Mi", "1", "256Mi"),
+        "standard": _resources("100m", "128Mi", "2", "512Mi"),
+        "heavy": _resources("500m", "1Gi", "2", "2Gi"),
+    },
+    "large": {
+        "light": _resources("100m", "128Mi", "2", "512Mi"),
+        "standard": _resources("500m", "512Mi", "4", "1Gi"),
+        "heavy": _resources("1", "2Gi", "4", "4Gi"),
+    },
+}
+
+
+def container_resources(config, container, size):
+    """Return the Kubernetes ``resources`` of ``container``.
+
+    ``size`` picks the container's requests and limits from the configured
+    profile, and the ``resources`` option overrides single values per
+    container name. Raises ValueError on invalid config.
+    """
+    profile = config["resource-profile"]
+    if profile not in PROFILES:
+        raise ValueError(f"unknown resource-profile {profile!r}")
+    resources = {
+        kind: dict(values) for kind, values in PROFILES[profile].get(size, {}).items()
+    }
+
+    overrides = yaml.safe_load(config["resources"]) or {}
+    if not isinstance(overrides, dict):
+        raise ValueError("resources must be a mapping of container names")
+    for kind, values in (overrides.get(container) or {}).items():
+        if kind not in ("requests", "limits") or not isinstance(values, dict):
+            raise ValueError(f"invalid resources for {container}: {kind!r}")
+        for name, quantity in values.items():
+            if name not in ("cpu", "memory"):
+                raise ValueError(f"invalid resources for {container}: {name!r}")
+            parse_quantity(quantity)
+            resources.setdefault(kind, {})[name] = str(quantity)
+
+    requests, limits = resources.get("requests", {}), resources.get("limits", {})
+    for name in set(requests) & set(limits):
+        if parse_quantity(requests[name]) > parse_quantity(limits[name]):
+            raise ValueError(f"{container} {name} request exceeds its limit")
+    return resources
@@ -0,0 +1,6 @@
+from charms.reactive import clear_flag, when_any
+
+
+@when_any("config.changed.resource-profile", "config.changed.resources")
+def resources_config_changed():
+    clear_flag("charm.started")
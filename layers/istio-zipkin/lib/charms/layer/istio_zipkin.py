@@ -0,0 +1,38 @@
+from charms.reactive import endpoint_from_name
+
+
+def sampling(config):
+    """Return the percentage of requests to trace."""
+    value = config["trace-sampling"]
+    if not 0 <= value <= 100:
+        raise ValueError("trace-sampling must be between 0 and 100")
+    return value
+
+
+def address(namespace, config):
+    """Return the ``host:port`` of the related Zipkin collector, or None.
+
+    Tracing is off, and None returned, while the charm is not related to
+    istio-tracing or trace-sampling is 0.
+    """
+    if not sampling(config):
+        return None
+    services = endpoint_from_name("istio-tracing").services()
+    hosts = [host for service in services for host in service["hosts"]]
+    if not hosts:
+        return None
+    return f"{hosts[0]['hostname']}.{namespace}.svc:{hosts[0]['port']}"
+
+
+def mixer_args(namespace, config):
+    zipkin = address(namespace, config)
+    if not zipkin:
+        return []
+    return [f"--trace_zipkin_url=http://{zipkin}/api/v1/spans"]
+
+
+def proxy_args(namespace, config):
+    zipkin = address(namespace, config)
+    if not zipkin:
+        return []
+    return ["--zipkinAddress", zipkin]
@@ -0,0 +1,13 @@
+from charms.reactive import clear_flag, when, when_any
+
+
+@when("config.changed.trace-sampling")
+def sampling_changed():
+    clear_flag("charm.started")
+
+
+@when_any("endpoint.istio-tracing.changed", "endpoint.istio-tracing.departed")
+def tracing_changed():
+    clear_flag("endpoint.istio-tracing.changed")
+    clear_flag("endpoint.istio-tracing.departed")
+    clear_flag("charm.started")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Check that every charm renders the same Istio mesh config.
+
+istio-pilot, istio-galley and istio-sidecar-injector each mount a copy of
+the mesh config, built by the shared istio-mesh layer from their own charm
+config. The copies drift apart when the charms are configured differently,
+or when a charm stops using the shared builder.
+
+Each charm's ``start_charm`` is run offline with the benchmark harness and
+the mounted meshes are compared. The charms are configured from the
+applications' options in a bundle:
+
+    python3 tools/check_mesh_drift.py --bundle bundle.yaml
+
+or, with ``--model``, from the config of the deployed applications, read
+with ``juju config``:
+
+    python3 tools/check_mesh_drift.py --model kubeflow
+
+Every option is used, not only the istio-mesh ones, so settings from other
+layers that end up in the mesh, such as istio-config-source's, are covered.
+Without arguments the charms' default config is rendered, which checks that
+they all build the mesh with the shared layer.
+
+Exits non-zero and prints the differing keys when the copies differ.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Charm and the path of its mesh file inside the pod spec.
+CHARMS = {
+    "istio-pilot": ("discovery", "config-volume"),
+    "istio-galley": ("galley", "mesh-config"),
+    "istio-sidecar-injector": ("sidecar-injector-webhook", "config-volume"),
+}
+
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        flat = {}
+        for key, child in value.items():
+            flat.update(_flatten(child, f"{prefix}{key}."))
+        return flat
+    return {prefix.rstrip("."): json.dumps(value, sort_keys=True)}
+
+
+def bundle_config(path):
+    applications = (yaml.safe_load(Path(path).read_text()) or {}).get(
+        "applications"
+    ) or {}
+    return {
+        charm: (applications.get(charm) or {}).get("options") or {}
+        for charm in CHARMS
+    }
+
+
+def deployed_config(model):
+    configs = {}
+    for charm in CHARMS:
+        output = subprocess.run(
+            ["juju", "config", "-m", model, charm, "--format", "yaml"],
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout
+        settings = yaml.safe_load(output)["settings"]
+        configs[charm] = {
+            name: setting["value"]
+            for name, setting in settings.items()
+            if "value" in setting
+        }
+    return configs
+
+
+def rendered_meshes(configs):
+    sys.path.insert(0, str(ROOT / "benchmarks"))
+    import bench_start_charm as bench
+
+    meshes = {}
+    for charm, (container_name, volume) in CHARMS.items():
+        harness = bench.Harness(ROOT / "charms" / charm)
+        harness.config.update(configs.get(charm, {}))
+        with bench._charm_environment(harness) as module:
+            module.start_charm()
+        if harness.pod_spec is None:
+            raise SystemExit(f"{charm} did not set a pod spec with its config")
+        container = next(
+            c for c in harness.pod_spec["containers"] if c["name"] == container_name
+        )
+        files = next(f for f in container["files"] if f["name"] == volume)
+        meshes[charm] = yaml.safe_load(files["files"]["mesh"])
+    return meshes
+
+
+def differences(values):
+    flat = {charm: _flatten(value) for charm, value in values.items()}
+    keys = sorted(set().union(*flat.values()))
+    return {
+        key: {charm: flat[charm].get(key) for charm in flat}
+        for key in keys
+        if len({flat[charm].get(key) for charm in flat}) > 1
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--bundle", help="configure the charms from a bundle")
+    source.add_argument("--model", help="configure the charms from a deployed model")
+    args = parser.parse_args(argv)
+
+    if args.bundle:
+        configs = bundle_config(args.bundle)
+    elif args.model:
+        configs = deployed_config(args.model)
+    else:
+        configs = {}
+    values = rendered_meshes(configs)
+    drift = differences(values)
+    for key, per_charm in drift.items():
+        print(f"{key}:")
+        for charm, value in per_charm.items():
+            print(f"  {charm}: {value}")
+    if not drift:
+        print(f"no drift between {', '.join(values)}")
+    return 1 if drift else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Generate Prometheus recording rules from the Grafana dashboards.
+
+The Istio dashboards shipped by the grafana charm aggregate the raw
+``istio_*`` request and TCP metrics on every refresh, e.g.::
+
+    sum(irate(istio_requests_total{reporter="source",...}[5m])) by (...)
+
+Every such ``sum(rate(...))``/``sum(irate(...))`` over an Istio metric is
+rewritten to read a pre-aggregated series instead::
+
+    sum(istio_dashboard:istio_requests_total:rate5m{reporter="source",...}) by (...)
+
+and one recording rule per metric and window is emitted::
+
+    istio_dashboard:istio_requests_total:rate5m =
+        sum(rate(istio_requests_total[5m])) by (<labels the dashboards use>)
+
+The recorded series keep only the labels that appear in the dashboards'
+selectors and ``by`` clauses, so the cost of rendering a dashboard no longer
+grows with the number of pods in the mesh. ``irate`` becomes ``rate`` over
+the same window, since recorded series are evaluated at a fixed interval.
+
+The script is idempotent: label usage is also collected from expressions
+that have already been rewritten, so rerunning it reproduces the same rules.
+
+    python3 tools/generate_recording_rules.py          # rewrite in place
+    python3 tools/generate_recording_rules.py --check  # fail if out of date
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+DASHBOARDS = ROOT / "charms/grafana/files"
+RULES = ROOT / "charms/prometheus/files/recording-rules.yml"
+
+RULE_GROUP = "istio-dashboards"
+RECORD_PREFIX = "istio_dashboard"
+
+# Only the high-cardinality metrics reported by istio-telemetry are recorded.
+METRIC = r"istio_[a-z_]+"
+SELECTOR = r"\{[^}]*\}"
+WINDOW = r"\d+[smh]"
+
+# sum(i?rate(metric{selector}[window])) or sum by (...) (i?rate(...))
+RAW = re.compile(
+    rf"(?P<head>sum\s*(?:by\s*\([^)]*\)\s*)?\(\s*)"
+    rf"i?rate\((?P<metric>{METRIC})(?P<selector>{SELECTOR})?\[(?P<window>{WINDOW})\]\)"
+    rf"(?P<tail>\s*\))"
+)
+RECORDED = re.compile(
+    rf"(?P<head>sum\s*(?:by\s*\([^)]*\)\s*)?\(\s*)"
+    rf"{RECORD_PREFIX}:(?P<metric>{METRIC}):rate(?P<window>{WINDOW})"
+    rf"(?P<selector>{SELECTOR})?(?P<tail>\s*\))"
+)
+BY = re.compile(r"\s*\bby\s*\((?P<labels>[^)]*)\)")
+LABEL = re.compile(r"(\w+)\s*(?:=~|!~|!=|=)")
+
+
+def record_name(metric, window):
+    return f"{RECORD_PREFIX}:{metric}:rate{window}"
+
+
+def iter_exprs(node):
+    """Yield every dict in ``node`` that has a string ``expr`` key."""
+    if isinstance(node, dict):
+        if isinstance(node.get("expr"), str):
+            yield node
+        for value in node.values():
+            yield from iter_exprs(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from iter_exprs(value)
+
+
+def _labels_used(expr, match):
+    labels = set(LABEL.findall(match["selector"] or ""))
+    # The by clause either sits in the sum() head or directly follows it.
+    by = BY.search(match["head"]) or BY.match(expr, match.end())
+    if by:
+        labels.update(label.strip() for label in by["labels"].split(","))
+    return {label for label in labels if label}
+
+
+def collect(dashboards):
+    """Return ``{(metric, window): labels}`` for every aggregation to record."""
+    usage = defaultdict(set)
+    for dashboard in dashboards.values():
+        for target in iter_exprs(dashboard):
+            expr = target["expr"]
+            for pattern in (RAW, RECORDED):
+                for match in pattern.finditer(expr):
+                    key = (match["metric"], match["window"])
+                    usage[key] |= _labels_used(expr, match)
+    return usage
+
+
+def rewrite(expr):
+    def replace(match):
+        name = record_name(match["metric"], match["window"])
+        return f"{match['head']}{name}{match['selector'] or ''}{match['tail']}"
+
+    return RAW.sub(replace, expr)
+
+
+def build_rules(usage):
+    rules = []
+    for (metric, window), labels in sorted(usage.items()):
+        by = ", ".join(sorted(labels))
+        rules.append(
+            {
+                "record": record_name(metric, window),
+                "expr": f"sum(rate({metric}[{window}])) by ({by})",
+            }
+        )
+    return {"groups": [{"name": RULE_GROUP, "rules": rules}]}
+
+
+def render_dashboard(dashboard, original):
+    text = json.dumps(dashboard, indent=2, ensure_ascii=False)
+    return text + "\n" if original.endswith("\n") else text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="exit non-zero instead of writing if any output is out of date",
+    )
+    args = parser.parse_args(argv)
+
+    sources = {path: path.read_text() for path in sorted(DASHBOARDS.glob("*.json"))}
+    dashboards = {path: json.loads(text) for path, text in sources.items()}
+    usage = collect(dashboards)
+
+    outputs = {}
+    for path, dashboard in dashboards.items():
+        for target in iter_exprs(dashboard):
+            target["expr"] = rewrite(target["expr"])
+        outputs[path] = render_dashboard(dashboard, sources[path])
+
+    header = (
+        "# Generated by tools/generate_recording_rules.py from the grafana\n"
+        "# charm's dashboards. Do not edit by hand.\n"
+    )
+    outputs[RULES] = header + yaml.dump(
+        build_rules(usage), default_flow_style=False, sort_keys=False, width=1000
+    )
+
+    stale = [
+        path
+        for path, text in outputs.items()
+        if not path.exists() or path.read_text() != text
+    ]
+    if args.check:
+        for path in stale:
+            print(f"out of date: {path.relative_to(ROOT)}", file=sys.stderr)
+        return 1 if stale else 0
+
+    for path in stale:
+        path.write_text(outputs[path])
+        print(f"wrote {path.relative_to(ROOT)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
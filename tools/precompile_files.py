@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Precompile the charms' large YAML files into JSON artifacts.
+
+Run this after editing any of the source files below and commit the
+regenerated ``files/compiled/*.json``. The charms fall back to parsing the
+YAML when an artifact is missing or stale, so forgetting to run this only
+costs hook time, not correctness.
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+from types import ModuleType
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SOURCES = [
+    "charms/istio-galley/files/crd.yaml",
+    "charms/istio-sidecar-injector/files/inject-config.yaml",
+    "charms/prometheus/files/prometheus.yml",
+]
+
+
+def _load_istio_files():
+    # The layer library only needs hookenv.log, which is unused when
+    # compiling, so provide a minimal stand-in outside of a hook.
+    hookenv = ModuleType("charmhelpers.core.hookenv")
+    hookenv.log = print
+    core = ModuleType("charmhelpers.core")
+    core.hookenv = hookenv
+    sys.modules.setdefault("charmhelpers", ModuleType("charmhelpers"))
+    sys.modules.setdefault("charmhelpers.core", core)
+    sys.modules.setdefault("charmhelpers.core.hookenv", hookenv)
+
+    path = ROOT / "layers/istio-files/lib/charms/layer/istio_files.py"
+    spec = importlib.util.spec_from_file_location("istio_files", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    istio_files = _load_istio_files()
+    for source in SOURCES:
+        documents = istio_files.compile_yaml(ROOT / source)
+        print(f"{istio_files.artifact_path(source)}: {len(documents)} document(s)")
+
+
+if __name__ == "__main__":
+    main()